@@ -0,0 +1,623 @@
+import json
+import logging
+import pathlib
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+import pytest
+import sqlite_utils
+from click.testing import CliRunner
+from PIL import Image
+
+from whatsapp_to_sqlite import benchmark, utils
+from whatsapp_to_sqlite.cli import cli
+from whatsapp_to_sqlite.messages import RoomMessage
+from whatsapp_to_sqlite.metrics import Metrics
+from whatsapp_to_sqlite.parser import MessageException
+
+
+LOGS = pathlib.Path(__file__).parent / "logs"
+
+# tables `save_room` writes to, compared across writers
+WRITTEN_TABLES = ("message", "message_x_message", "file_chat", "room", "sender")
+
+
+@pytest.fixture
+def chat_files():
+    return sorted(LOGS.rglob("*.txt"))
+
+
+class TestParseRoomFiles:
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_order_and_errors(self, chat_files, jobs):
+        logger = logging.getLogger(__name__)
+        parsed = list(utils.parse_room_files(chat_files, "de_de", logger, jobs=jobs))
+
+        assert [file for file, _ in parsed] == chat_files
+        for file, parse_room in parsed:
+            try:
+                expected = utils.parse_room_file(file, "de_de", logger)
+            except MessageException as error:
+                with pytest.raises(MessageException) as excinfo:
+                    parse_room()
+                assert excinfo.value.file_path == file
+                assert excinfo.value.reason == error.reason
+                continue
+
+            assert parse_room() == expected
+
+
+class TestPipelineRoomFiles:
+    def test_order_and_errors(self, chat_files, logger):
+        parsed = utils.parse_room_files(chat_files, "de_de", logger)
+        pipelined = list(utils.pipeline_room_files(parsed, queue_size=2))
+
+        assert [file for file, _ in pipelined] == chat_files
+        for file, parse_room in pipelined:
+            try:
+                expected = utils.parse_room_file(file, "de_de", logger)
+            except MessageException as error:
+                with pytest.raises(MessageException) as excinfo:
+                    parse_room()
+                assert excinfo.value.reason == error.reason
+                continue
+
+            assert parse_room() == expected
+
+    def test_queue_is_bounded(self):
+        parsed_count = 0
+
+        def parse_room():
+            nonlocal parsed_count
+            parsed_count += 1
+            return iter([])
+
+        files = [(pathlib.Path(f"{i}.txt"), parse_room) for i in range(20)]
+        stats = utils.PipelineStats(queue_size=2)
+        pipelined = utils.pipeline_room_files(files, 2, stats=stats)
+        next(pipelined)
+        time.sleep(0.3)
+
+        # two rooms in the queue and one waiting for a free slot
+        assert parsed_count == 4
+        assert stats.queued == 2
+        assert stats.blocked_seconds > 0
+
+        pipelined.close()
+        assert parsed_count < len(files)
+
+
+class TestIncrementalImport:
+    def test_append_to_previous_import(self, db, logger, tmp_path):
+        chat_file = tmp_path / "WhatsApp Chat mit Jane Doe.txt"
+        chat_file.write_text(
+            "16.02.21, 22:10 - Jane Doe: Hi\n16.02.21, 22:33 - John Doe: Hallo\n",
+            encoding="utf-8",
+        )
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+
+        room = utils.parse_room_file(chat_file, "de_de", logger)
+        state = utils.save_room(room, "Jane Doe", system_message_id, db)
+        utils.record_room_import(db, chat_file, state)
+        assert (
+            utils.get_previous_imports([chat_file], "de_de", db)[chat_file]["size"]
+            == chat_file.stat().st_size
+        )
+
+        with chat_file.open("a", encoding="utf-8") as file_obj:
+            file_obj.write("17.02.21, 08:00 - Jane Doe: Neu\n")
+
+        previous_import = utils.get_previous_imports([chat_file], "de_de", db)[
+            chat_file
+        ]
+        tail = utils.parse_room_file(
+            chat_file, "de_de", logger, offset=previous_import["size"]
+        )
+        assert [message.text for message in tail] == ["Neu\n"]
+
+        state = utils.append_to_room(tail, previous_import, system_message_id, db)
+        utils.record_room_import(db, chat_file, state)
+
+        assert db["room"].count == 1
+        assert [row["depth"] for row in db["message"].rows] == [1, 2, 3]
+        assert db["message_x_message"].count == 2
+        assert state["depth"] == 3
+
+    def test_continued_file_is_hashed_once(self, db, logger, tmp_path, monkeypatch):
+        chat_file = tmp_path / "WhatsApp Chat mit Jane Doe.txt"
+        chat_file.write_text("16.02.21, 22:10 - Jane Doe: Hi\n", encoding="utf-8")
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+        room = utils.parse_room_file(chat_file, "de_de", logger)
+        state = utils.save_room(room, "Jane Doe", system_message_id, db)
+        utils.record_room_import(db, chat_file, state)
+        with chat_file.open("a", encoding="utf-8") as file_obj:
+            file_obj.write("17.02.21, 08:00 - Jane Doe: Neu\n")
+
+        hashed = []
+        get_prefix_hashes = utils._get_prefix_hashes
+
+        def counting_get_prefix_hashes(file_path, offsets):
+            hashed.append(file_path)
+            return get_prefix_hashes(file_path, offsets)
+
+        monkeypatch.setattr(utils, "_get_prefix_hashes", counting_get_prefix_hashes)
+        digests = {}
+        previous_import = utils.get_previous_imports(
+            [chat_file], "de_de", db, digests=digests
+        )[chat_file]
+        tail = utils.parse_room_file(
+            chat_file, "de_de", logger, offset=previous_import["size"]
+        )
+        state = utils.append_to_room(tail, previous_import, system_message_id, db)
+        utils.record_room_import(db, chat_file, state, digests.get(chat_file))
+
+        assert hashed == [chat_file]
+        assert db["room_import"].get(state["room_id"])["sha512sum"] == (
+            get_prefix_hashes(chat_file, [chat_file.stat().st_size])[
+                chat_file.stat().st_size
+            ]
+        )
+
+    def test_changed_prefix_is_not_continued(self, db, logger, tmp_path):
+        chat_file = tmp_path / "WhatsApp Chat mit Jane Doe.txt"
+        chat_file.write_text("16.02.21, 22:10 - Jane Doe: Hi\n", encoding="utf-8")
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+
+        room = utils.parse_room_file(chat_file, "de_de", logger)
+        state = utils.save_room(room, "Jane Doe", system_message_id, db)
+        utils.record_room_import(db, chat_file, state)
+
+        chat_file.write_text(
+            "16.02.21, 22:11 - Jane Doe: Ho\n16.02.21, 22:12 - Jane Doe: Hi\n",
+            encoding="utf-8",
+        )
+        assert utils.get_previous_imports([chat_file], "de_de", db) == {}
+
+
+class TestStreamingImport:
+    @pytest.mark.parametrize("mode", utils.PARSER_MODES)
+    def test_identical_to_parse_room_file(self, chat_files, logger, mode):
+        for chat_file in chat_files:
+            try:
+                expected = utils.parse_room_file(chat_file, "de_de", logger, mode)
+            except MessageException:
+                with pytest.raises(MessageException):
+                    list(utils.iter_room_file(chat_file, "de_de", logger, mode))
+                continue
+
+            streamed = utils.iter_room_file(chat_file, "de_de", logger, mode)
+            assert list(streamed) == expected
+
+    def test_failed_room_is_removed(self, db, logger, tmp_path, monkeypatch):
+        monkeypatch.setattr(utils, "INSERT_BATCH_SIZE", 1)
+        chat_file = tmp_path / "WhatsApp Chat mit Jane Doe.txt"
+        chat_file.write_text(
+            "16.02.21, 22:10 - Jane Doe: Hi\n"
+            "16.02.21, 22:11 - Jane Doe: IMG-1.jpg (Datei angehängt)\n"
+            "16.02.21, 22:12 Jane Doe: Broken\n",
+            encoding="utf-8",
+        )
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+
+        room = utils.iter_room_file(chat_file, "de_de", logger, "scanner")
+        with pytest.raises(MessageException):
+            utils.save_room(room, "Jane Doe", system_message_id, db)
+
+        assert db["message"].count == 0
+        assert db["file_chat"].count == 0
+        assert db["room"].count == 0
+
+
+class TestBulkLoad:
+    def test_commits_and_restores_settings(self, logger, tmp_path):
+        db = sqlite_utils.Database(tmp_path / "messages.db")
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+        room = utils.parse_string("16.02.21, 22:10 - Jane Doe: Hi\n", "de_de", logger)
+
+        with utils.bulk_load(db, logger) as bulk_db:
+            assert bulk_db.execute("PRAGMA synchronous").fetchone()[0] == 0
+            utils.save_room(room, "Jane Doe", system_message_id, bulk_db)
+            assert bulk_db.conn.in_transaction
+
+        assert not db.conn.in_transaction
+        assert db["message"].count == 1
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert db.execute("PRAGMA synchronous").fetchone()[0] == 2
+
+    def test_rolls_back_uncommitted_rooms(self, logger, tmp_path):
+        db = sqlite_utils.Database(tmp_path / "messages.db")
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+        room = utils.parse_string("16.02.21, 22:10 - Jane Doe: Hi\n", "de_de", logger)
+
+        with pytest.raises(KeyboardInterrupt):
+            with utils.bulk_load(db, logger) as bulk_db:
+                utils.save_room(room, "Jane Doe", system_message_id, bulk_db)
+                bulk_db.conn.commit()
+                utils.save_room(room, "Jane Doe", system_message_id, bulk_db)
+                raise KeyboardInterrupt()
+
+        assert db["room"].count == 1
+
+
+class TestSenderRegistry:
+    def test_senders_are_shared_across_rooms(self, db, logger):
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+        sender_registry = utils.SenderRegistry(db)
+        room = utils.parse_string(
+            "16.02.21, 22:10 - Jane Doe: Hi\n"
+            "16.02.21, 22:11 - ‎Jane Doe hat John Doe hinzugefügt.\n",
+            "de_de",
+            logger,
+        )
+
+        for room_name in ("Jane Doe", "John Doe"):
+            utils.save_room(
+                room, room_name, system_message_id, db, sender_registry=sender_registry
+            )
+
+        assert sorted(row["name"] for row in db["sender"].rows) == [
+            "Jane Doe",
+            "John Doe",
+        ]
+        assert len({row["sender_id"] for row in db["message"].rows}) == 1
+        assert utils.SenderRegistry(db).get_id("Jane Doe") == sender_registry.get_id(
+            "Jane Doe"
+        )
+
+    def test_unique_sender_names(self, db, logger):
+        utils.init_db(db, logger)
+        db["sender"].insert({"id": "1", "name": "Jane Doe"})
+
+        with pytest.raises(sqlite3.IntegrityError):
+            db["sender"].insert({"id": "2", "name": "Jane Doe"})
+
+
+class TestWriters:
+    def test_identical_rows(self, chat_files, logger):
+        system_message_id = uuid.uuid4()
+        rooms = []
+        for chat_file in chat_files:
+            try:
+                rooms.append(utils.parse_room_file(chat_file, "de_de", logger))
+            except MessageException:
+                continue
+
+        tables = {}
+        for writer in utils.WRITERS:
+            db = sqlite_utils.Database(":memory:")
+            utils.init_db(db, logger)
+            sender_registry = utils.SenderRegistry(db, deterministic_ids=True)
+            # importing twice must not duplicate rows either
+            for room in rooms + rooms:
+                utils.save_room(
+                    room,
+                    "Jane Doe",
+                    system_message_id,
+                    db,
+                    sender_registry=sender_registry,
+                    deterministic_ids=True,
+                    writer=writer,
+                )
+            tables[writer] = {
+                table: db.execute(f"SELECT * FROM [{table}] ORDER BY 1, 2").fetchall()
+                for table in WRITTEN_TABLES
+            }
+
+        assert tables["executemany"] == tables["sqlite-utils"]
+        assert len(tables["executemany"]["message"]) == sum(map(len, rooms))
+
+
+class TestDeterministicIds:
+    def test_reimport_does_not_duplicate(self, db, logger, tmp_path):
+        chat_file = tmp_path / "WhatsApp Chat mit Jane Doe.txt"
+        chat_file.write_text(
+            "16.02.21, 22:10 - Jane Doe: Hi\n"
+            "16.02.21, 22:11 - Jane Doe: IMG-1.jpg (Datei angehängt)\n"
+            "16.02.21, 22:11 - Jane Doe: IMG-1.jpg (Datei angehängt)\n",
+            encoding="utf-8",
+        )
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+
+        states = []
+        for mode in utils.PARSER_MODES:
+            room = utils.parse_room_file(chat_file, "de_de", logger, mode)
+            states.append(
+                utils.save_room(
+                    room,
+                    "Jane Doe",
+                    system_message_id,
+                    db,
+                    sender_registry=utils.SenderRegistry(db, deterministic_ids=True),
+                    deterministic_ids=True,
+                )
+            )
+
+        assert states[0] == states[1]
+        assert db["room"].count == 1
+        assert db["sender"].count == 1
+        assert db["message"].count == 3
+        assert db["file_chat"].count == 2
+        assert db["message_x_message"].count == 2
+
+    def test_same_name_different_chats(self, db, logger):
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+
+        for text in ("Hi", "Ho"):
+            room = utils.parse_string(
+                f"16.02.21, 22:10 - Jane Doe: {text}\n", "de_de", logger
+            )
+            utils.save_room(
+                room, "Jane Doe", system_message_id, db, deterministic_ids=True
+            )
+
+        assert db["room"].count == 2
+        assert db["message"].count == 2
+
+
+class TestOptimize:
+    def test_creates_indexes_and_statistics(self, logger, tmp_path):
+        db_path = tmp_path / "messages.db"
+        db = sqlite_utils.Database(db_path)
+        utils.init_db(db, logger)
+        db.close()
+
+        result = CliRunner().invoke(cli, ["optimize", str(db_path), "--vacuum"])
+
+        assert result.exit_code == 0, result.output
+        assert "MiB" in result.output
+        db = sqlite_utils.Database(db_path)
+        indexes = {
+            (table, tuple(index.columns))
+            for table in ("message", "file_fs", "file_chat")
+            for index in db[table].indexes
+        }
+        assert {(table, tuple(columns)) for table, columns in utils.INDEXES} <= indexes
+        assert "sqlite_stat1" in db.table_names()
+
+
+class TestBackup:
+    @pytest.mark.parametrize("strategy", ["copy", "backup", "vacuum"])
+    def test_backup_strategies(self, logger, tmp_path, strategy):
+        db_path = tmp_path / "messages.db"
+        db = sqlite_utils.Database(db_path)
+        utils.init_db(db, logger)
+        db.close()
+        progress = []
+
+        backup_path = utils.make_db_backup(
+            db_path,
+            logger,
+            strategy,
+            progress_callback=lambda *args: progress.append(args),
+        )
+
+        assert backup_path.parent == tmp_path
+        assert "room_import" in sqlite_utils.Database(backup_path).table_names()
+        assert bool(progress) == (strategy == "backup")
+
+    def test_rollback_on_failed_chat_file(self, tmp_path):
+        chat_directory = tmp_path / "chats"
+        chat_directory.mkdir()
+        (chat_directory / "WhatsApp Chat mit Jane Doe.txt").write_text(
+            "16.02.21, 22:10 - Jane Doe: Hi\n", encoding="utf-8"
+        )
+        (chat_directory / "WhatsApp Chat mit John Doe.txt").write_text(
+            "not a chat log\n", encoding="utf-8"
+        )
+        db_path = tmp_path / "messages.db"
+
+        result = CliRunner().invoke(
+            cli, ["import-chats", str(chat_directory), str(db_path), "-b", "rollback"]
+        )
+
+        assert result.exit_code == 1
+        assert "rolled back" in result.output
+        assert sqlite_utils.Database(db_path)["message"].count == 0
+
+    def test_prune_backups(self, logger, tmp_path):
+        db_path = tmp_path / "messages.db"
+        sqlite_utils.Database(db_path)["room"].insert({"id": "1"})
+        backup_paths = [
+            utils.make_db_backup(db_path, logger, keep_backups=2) for _ in range(4)
+        ]
+
+        assert sorted(tmp_path.glob("messages.*.bkp.db")) == sorted(backup_paths[2:])
+        assert utils.make_db_backup(db_path, logger, "rollback", keep_backups=1) is None
+        assert list(tmp_path.glob("messages.*.bkp.db")) == backup_paths[3:]
+
+    def test_single_transaction_rolls_back(self, logger, tmp_path):
+        db = sqlite_utils.Database(tmp_path / "messages.db")
+        utils.init_db(db, logger)
+        system_message_id = utils.get_system_message_id(db)
+        room = utils.parse_string("16.02.21, 22:10 - Jane Doe: Hi\n", "de_de", logger)
+
+        with pytest.raises(KeyboardInterrupt):
+            with utils.single_transaction(db) as transaction_db:
+                utils.save_room(room, "Jane Doe", system_message_id, transaction_db)
+                raise KeyboardInterrupt()
+
+        assert db["room"].count == 0
+        assert db["message"].count == 0
+
+        with utils.single_transaction(db) as transaction_db:
+            utils.save_room(room, "Jane Doe", system_message_id, transaction_db)
+        assert not db.conn.in_transaction
+        assert db["message"].count == 1
+
+
+class TestBenchmark:
+    def test_generated_chats_cover_all_system_events(self, logger, tmp_path):
+        chat_files = benchmark.generate_chat_files(tmp_path, 500, rooms=2, seed=1)
+
+        for chat_file in chat_files:
+            messages = utils.parse_room_file(chat_file, "de_de", logger, "grammar")
+            assert len(messages) == 250
+            system_messages = messages[: len(benchmark.SYSTEM_EVENTS)]
+            assert not any(
+                isinstance(message, RoomMessage) for message in system_messages
+            )
+            assert utils.parse_room_file(chat_file, "de_de", logger, "scanner") == (
+                messages
+            )
+        assert [path.read_bytes() for path in chat_files] == [
+            path.read_bytes()
+            for path in benchmark.generate_chat_files(
+                tmp_path / "again", 500, rooms=2, seed=1
+            )
+        ]
+
+    def test_run_and_compare(self, logger, tmp_path):
+        result = CliRunner().invoke(
+            cli,
+            [
+                "benchmark",
+                str(tmp_path),
+                "--messages",
+                "300",
+                "--unreferenced-files",
+                "3",
+                "--output",
+                str(tmp_path / "baseline.json"),
+            ],
+        )
+        assert result.exit_code == 0, result.output
+
+        results = benchmark.load_results(tmp_path / "baseline.json")
+        assert list(results["stages"]) == list(benchmark.STAGES)
+        assert results["stages"]["parse-scanner"]["items"] == 300
+        assert results["stages"]["save-executemany"]["items"] == 300
+        attachments = sum(
+            getattr(message, "file", False)
+            for chat_file in (tmp_path / "chats").glob("*.txt")
+            for message in utils.parse_room_file(chat_file, "de_de", logger)
+        )
+        assert results["stages"]["match-media"]["items"] == attachments
+        assert results["stages"]["import-media"]["items"] > 3
+        assert set(benchmark.compare_results(results, results).values()) == {1.0}
+
+    def test_without_media(self, tmp_path):
+        result = CliRunner().invoke(
+            cli,
+            [
+                "benchmark",
+                str(tmp_path),
+                "--messages",
+                "300",
+                "--unreferenced-files",
+                "2",
+                "--media-scale",
+                "0",
+                "--image-size",
+                "8",
+                "8",
+            ],
+        )
+        assert result.exit_code == 0, result.output
+
+        media_directory = tmp_path / "media"
+        media_files = [path for path in media_directory.rglob("*") if path.is_file()]
+        assert len(media_files) == 2
+        assert "match-media" in result.output
+
+        media_files = benchmark.generate_media_tree(
+            tmp_path / "small",
+            sorted((tmp_path / "chats").glob("*.txt")),
+            image_size=(8, 8),
+            media_scale=0.5,
+        )
+        assert media_files
+        with Image.open(media_files[0]) as image:
+            assert image.size == (8, 8)
+
+
+class TestMetrics:
+    def test_import_chats_writes_metrics_and_profiles(self, tmp_path):
+        chat_file = tmp_path / "WhatsApp Chat mit Jane Doe.txt"
+        chat_file.write_text(
+            "16.02.21, 22:10 - Jane Doe: Hi\n16.02.21, 22:11 - John Doe: Hello\n",
+            encoding="utf-8",
+        )
+        metrics_path = tmp_path / "metrics.json"
+
+        result = CliRunner().invoke(
+            cli,
+            [
+                "import-chats",
+                str(chat_file),
+                str(tmp_path / "messages.db"),
+                "--metrics-json",
+                str(metrics_path),
+                "--profile",
+                str(tmp_path / "profiles"),
+            ],
+        )
+
+        assert result.exit_code == 0, result.output
+        metrics = json.loads(metrics_path.read_text(encoding="utf-8"))
+        assert {"crawl", "parse", "prepare", "insert"} <= set(metrics["stages"])
+        assert metrics["stages"]["insert"]["items"] == 2
+        assert metrics["files"][str(chat_file)]["parse"]["bytes"] > 0
+        assert (tmp_path / "profiles" / "parse.pstats").exists()
+
+    def test_measure_accumulates(self):
+        metrics = Metrics()
+        metrics.set_file(pathlib.Path("a.txt"))
+        for _ in range(2):
+            with metrics.measure("hash", size=1024**2) as counts:
+                counts["items"] += 1
+        metrics.set_file(None)
+        with metrics.measure("hash", items=1):
+            pass
+
+        result = metrics.to_dict()
+        assert result["stages"]["hash"]["calls"] == 3
+        assert result["stages"]["hash"]["items"] == 3
+        assert result["stages"]["hash"]["bytes"] == 2 * 1024**2
+        assert result["files"]["a.txt"]["hash"]["calls"] == 2
+
+
+class TestTimezoneOption:
+    def test_unknown_timezone(self, tmp_path):
+        result = CliRunner().invoke(
+            cli,
+            [
+                "import-chats",
+                str(LOGS),
+                str(tmp_path / "messages.db"),
+                "--timezone",
+                "Mars/Olympus_Mons",
+            ],
+        )
+
+        assert result.exit_code == 2
+        assert "Unknown time zone" in result.output
+
+
+class TestStartup:
+    def test_heavy_dependencies_are_not_imported(self):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import whatsapp_to_sqlite.cli"],
+            capture_output=True,
+            check=True,
+            cwd=pathlib.Path(__file__).parent.parent,
+            text=True,
+        )
+
+        # lines look like "import time: <self us> | <cumulative us> | <name>"
+        imported = {
+            line.split("|")[2].strip().split(".")[0]
+            for line in result.stderr.splitlines()[1:]
+        }
+        assert "whatsapp_to_sqlite" in imported
+        assert not imported & {"PIL", "arpeggio", "rich", "sqlite_utils"}
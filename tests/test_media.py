@@ -0,0 +1,363 @@
+import hashlib
+import io
+import sqlite3
+
+import pytest
+from PIL import Image
+
+from whatsapp_to_sqlite import utils
+from whatsapp_to_sqlite.metrics import Metrics
+
+
+@pytest.fixture
+def media_files(tmp_path):
+    files = []
+    for number in range(20):
+        media_file = tmp_path / f"DOC-{number:02}.bin"
+        media_file.write_bytes(bytes([number]) * (number * 100_000))
+        files.append(media_file)
+
+    image_file = tmp_path / "IMG-1.jpg"
+    Image.new("RGB", (64, 48), "red").save(image_file)
+    files.append(image_file)
+    return files
+
+
+class TestScanDirectory:
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_walks_in_name_order(self, tmp_path, jobs):
+        for name in ["b/d/2.txt", "b/1.txt", "a/3.jpg", "c.txt", "b/c/0.txt"]:
+            (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / name).write_text(name)
+        (tmp_path / "link").symlink_to(tmp_path / "b", target_is_directory=True)
+        (tmp_path / "dangling.txt").symlink_to(tmp_path / "missing.txt")
+
+        entries = list(utils.scan_directory(tmp_path, jobs=jobs))
+
+        assert [entry.path.relative_to(tmp_path).as_posix() for entry in entries] == [
+            "c.txt",
+            "a/3.jpg",
+            "b/1.txt",
+            "b/c/0.txt",
+            "b/d/2.txt",
+        ]
+        for entry in entries:
+            assert entry == utils.FileEntry.from_path(entry.path)
+        assert utils.crawl_directory(tmp_path, "*.jpg", jobs=jobs) == [
+            tmp_path / "a" / "3.jpg"
+        ]
+
+    def test_import_scanned_files(self, db, logger, media_files, tmp_path):
+        utils.init_db(db, logger)
+
+        utils.import_media_to_db(utils.scan_directory(tmp_path), db, logger)
+
+        assert [row["original_file_path"] for row in db["file_fs"].rows] == [
+            str(media_file) for media_file in sorted(media_files)
+        ]
+
+
+class TestImportMedia:
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_rows_in_file_order(self, db, logger, media_files, jobs, monkeypatch):
+        monkeypatch.setattr(utils, "INSERT_BATCH_SIZE", 8)
+        utils.init_db(db, logger)
+        progress = []
+
+        utils.import_media_to_db(
+            media_files, db, logger, lambda: progress.append(1), jobs=jobs
+        )
+
+        rows = list(db["file_fs"].rows)
+        assert len(progress) == len(media_files)
+        assert [row["original_file_path"] for row in rows] == [
+            str(media_file) for media_file in media_files
+        ]
+        for row, media_file in zip(rows, media_files):
+            content = media_file.read_bytes()
+            assert row["sha512sum"] == hashlib.sha512(content).hexdigest()
+            assert row["size"] == len(content)
+        assert rows[-1]["mime_type"] == "image/jpeg"
+        assert rows[-1]["preview"]
+
+    def test_unchanged_files_are_not_hashed_again(
+        self, db, logger, media_files, monkeypatch
+    ):
+        utils.init_db(db, logger)
+        utils.import_media_to_db(media_files, db, logger)
+        first_rows = list(db["file_fs"].rows)
+
+        media_files[1].write_bytes(b"changed")
+        hashed_files = []
+        get_hash = utils._get_hash
+
+        def record_hash(path):
+            hashed_files.append(path)
+            return get_hash(path)
+
+        monkeypatch.setattr(utils, "_get_hash", record_hash)
+        db["file_fs"].delete_where()
+        utils.import_media_to_db(media_files, db, logger)
+
+        rows = list(db["file_fs"].rows)
+        assert hashed_files == [media_files[1]]
+        assert rows[1]["sha512sum"] == hashlib.sha512(b"changed").hexdigest()
+        for first_row, row in list(zip(first_rows, rows))[2:]:
+            assert row["sha512sum"] == first_row["sha512sum"]
+            assert row["preview"] == first_row["preview"]
+
+        utils.import_media_to_db(media_files[:1], db, logger, use_cache=False)
+        assert hashed_files == [media_files[1], media_files[0]]
+
+    @pytest.mark.skipif(
+        not hasattr(sqlite3.Connection, "setlimit"), reason="needs Python 3.11"
+    )
+    def test_cache_lookup_within_old_variable_limit(self, db, logger, media_files):
+        utils.init_db(db, logger)
+        utils.import_media_to_db(media_files, db, logger)
+        # the default of SQLite before 3.32
+        db.conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+
+        paths = [
+            *media_files,
+            *(media_files[0].with_name(f"{n}.bin") for n in range(1000)),
+        ]
+        entries = utils._get_cached_media_entries(db, paths)
+        assert set(entries) == {str(path) for path in media_files}
+
+    def test_referenced_only(self, db, logger, media_files, monkeypatch):
+        utils.init_db(db, logger)
+        db["file_chat"].insert_all(
+            [{"id": "1", "name": "IMG-1.jpg"}, {"id": "2", "name": "DOC-03.bin"}]
+        )
+        hashed_files = []
+        get_hash = utils._get_hash
+        monkeypatch.setattr(
+            utils, "_get_hash", lambda path: hashed_files.append(path) or get_hash(path)
+        )
+        progress = []
+
+        utils.import_media_to_db(
+            media_files,
+            db,
+            logger,
+            lambda: progress.append(1),
+            referenced_only=True,
+        )
+
+        assert len(progress) == len(media_files)
+        assert sorted(row["name"] for row in db["file_fs"].rows) == [
+            "DOC-03.bin",
+            "IMG-1.jpg",
+        ]
+        assert sorted(path.name for path in hashed_files) == ["DOC-03.bin", "IMG-1.jpg"]
+
+
+class TestMatchMediaFiles:
+    def test_unambiguous_names_are_matched(self, db, logger):
+        utils.init_db(db, logger)
+        db["file_fs"].insert_all(
+            [
+                {
+                    "id": str(number),
+                    "name": name,
+                    "sha512sum": sha512sum,
+                    "mime_type": "image/jpeg",
+                    "size": number,
+                    "original_file_path": f"/media/{number}/{name}",
+                }
+                for number, (name, sha512sum) in enumerate(
+                    [
+                        ("IMG-1.jpg", "aa"),
+                        ("IMG-2.jpg", "aa"),
+                        ("IMG-3.jpg", "bb"),
+                        ("IMG-3.jpg", "cc"),
+                        ("IMG-4.jpg", "dd"),
+                    ]
+                )
+            ]
+        )
+        db["file_chat"].insert_all(
+            [
+                {"id": "a", "name": "IMG-1.jpg"},
+                {"id": "b", "name": "IMG-2.jpg"},
+                {"id": "c", "name": "IMG-3.jpg"},
+                {"id": "d", "name": "IMG-1.jpg"},
+                {"id": "e", "name": "IMG-5.jpg"},
+            ]
+        )
+
+        utils.match_media_files(db, logger)
+
+        assert {row["id"]: row["sha512sum"] for row in db["file_chat"].rows} == {
+            "a": "aa",
+            "b": "aa",
+            "c": None,
+            "d": "aa",
+            "e": None,
+        }
+        assert [(row["sha512sum"], row["size"]) for row in db["file_object"].rows] == [
+            ("aa", 0)
+        ]
+        assert db["file_object"].get("aa")["url"] == (
+            "http://whatsapp-media.local/aa?mimetype=image/jpeg"
+        )
+        assert [row["original_file_path"] for row in db["file_copyable"].rows] == [
+            "/media/0/IMG-1.jpg",
+            "/media/1/IMG-2.jpg",
+            "/media/0/IMG-1.jpg",
+        ]
+
+
+class TestGeneratePreviews:
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_deferred_previews(self, db, logger, media_files, jobs):
+        utils.init_db(db, logger)
+        db["file_chat"].insert({"id": "1", "name": "IMG-1.jpg"})
+        utils.import_media_to_db(media_files, db, logger, previews=False)
+        utils.match_media_files(db, logger)
+        assert db["file_fs"].count_where("preview IS NOT NULL") == 0
+
+        assert utils.generate_previews(db, logger, jobs=jobs) == 1
+
+        image_row = next(db["file_fs"].rows_where("name = ?", ["IMG-1.jpg"]))
+        with Image.open(io.BytesIO(image_row["preview"])) as preview:
+            assert max(preview.size) <= 20
+        assert db["file_object"].get(image_row["sha512sum"])["preview"]
+        assert db["file_fs_cache"].get(image_row["original_file_path"])["preview"]
+        # files without a preview are not decoded again
+        assert db["file_fs"].count_where("NOT preview_attempted") == 0
+        assert db["file_fs_cache"].count_where("NOT preview_attempted") == 0
+        assert utils.generate_previews(db, logger, jobs=jobs) == 0
+
+    def test_metrics_per_file(self, db, logger, media_files):
+        utils.init_db(db, logger)
+        metrics = Metrics()
+        utils.import_media_to_db(media_files, db, logger, jobs=4, metrics=metrics)
+
+        result = metrics.to_dict()
+        assert result["stages"]["hash"]["items"] == len(media_files)
+        assert set(result["files"]) == {str(path) for path in media_files}
+        image_stages = result["files"][str(media_files[-1])]
+        assert image_stages["hash"]["bytes"] == media_files[-1].stat().st_size
+        assert image_stages["preview"]["calls"] == 1
+
+    def test_deferred_previews_are_made_on_cache_hits(self, db, logger, media_files):
+        utils.init_db(db, logger)
+        utils.import_media_to_db(media_files, db, logger, previews=False)
+        image_path = str(media_files[-1])
+        assert db["file_fs_cache"].get(image_path)["preview"] is None
+
+        utils.import_media_to_db(media_files, db, logger)
+
+        cache_entry = db["file_fs_cache"].get(image_path)
+        assert cache_entry["preview"]
+        assert cache_entry["preview_attempted"]
+        image_rows = list(
+            db["file_fs"].rows_where("original_file_path = ?", [image_path])
+        )
+        assert image_rows[-1]["preview"] == cache_entry["preview"]
+
+
+class TestMoveFiles:
+    @pytest.mark.parametrize("strategy", utils.COPY_STRATEGIES)
+    def test_strategies(self, db, logger, media_files, tmp_path, strategy):
+        utils.init_db(db, logger)
+        output_directory = tmp_path / "output"
+        missing_file = tmp_path / "missing.jpg"
+        copyable_files = [*media_files[:3], missing_file, media_files[0]]
+        db["file_copyable"].insert_all(
+            {"original_file_path": str(path), "target_file_path": f"{number:04x}"}
+            for number, path in enumerate(copyable_files)
+        )
+        (output_directory / "00").mkdir(parents=True)
+        (output_directory / "00" / "0001").write_bytes(b"stale")
+
+        for _ in range(2):
+            deleteable_files = utils.move_files(
+                db, output_directory, logger, strategy=strategy, jobs=2
+            )
+
+            for number, path in enumerate(media_files[:3]):
+                target = output_directory / "00" / f"{number:04x}"
+                assert target.read_bytes() == path.read_bytes()
+                assert target.is_symlink() == (strategy == "symlink")
+            assert not (output_directory / "00" / "0003").exists()
+            expected_files = [] if strategy == "symlink" else media_files[:3]
+            assert deleteable_files == expected_files
+            assert "missing.jpg" in str(logger.error.call_args)
+
+    @pytest.mark.parametrize("strategy", utils.COPY_STRATEGIES)
+    def test_identical_sources(self, db, logger, tmp_path, strategy):
+        utils.init_db(db, logger)
+        output_directory = tmp_path / "output"
+        sources = []
+        for number in range(8):
+            source = tmp_path / f"copy-{number}" / "IMG-1.jpg"
+            source.parent.mkdir()
+            source.write_bytes(b"same content" * 100_000)
+            sources.append(source)
+        db["file_copyable"].insert_all(
+            {"original_file_path": str(path), "target_file_path": "0000"}
+            for path in sources
+        )
+
+        deleteable_files = utils.move_files(
+            db, output_directory, logger, strategy=strategy, jobs=4
+        )
+
+        target = output_directory / "00" / "0000"
+        assert target.read_bytes() == sources[0].read_bytes()
+        assert deleteable_files == ([] if strategy == "symlink" else sources)
+        logger.error.assert_not_called()
+        assert db["file_store"].count == 1
+
+    def test_symlinked_objects_are_replaced(self, db, logger, media_files, tmp_path):
+        utils.init_db(db, logger)
+        output_directory = tmp_path / "output"
+        digest = hashlib.sha512(media_files[1].read_bytes()).hexdigest()
+        db["file_copyable"].insert(
+            {"original_file_path": str(media_files[1]), "target_file_path": digest}
+        )
+        target = output_directory / digest[:2] / digest
+
+        assert utils.move_files(db, output_directory, logger, strategy="symlink") == []
+        assert target.is_symlink()
+        assert utils.verify_media_store(db, output_directory, logger) == [digest]
+
+        utils.move_files(db, output_directory, logger, strategy="symlink")
+        deleteable_files = utils.move_files(db, output_directory, logger)
+        assert deleteable_files == [media_files[1]]
+        assert not target.is_symlink()
+        assert target.read_bytes() == media_files[1].read_bytes()
+        assert utils.verify_media_store(db, output_directory, logger) == []
+
+    def test_stored_objects_are_skipped_and_verified(
+        self, db, logger, media_files, tmp_path
+    ):
+        utils.init_db(db, logger)
+        output_directory = tmp_path / "output"
+        digests = [
+            hashlib.sha512(path.read_bytes()).hexdigest() for path in media_files[:3]
+        ]
+        db["file_copyable"].insert_all(
+            {"original_file_path": str(path), "target_file_path": digest}
+            for path, digest in zip(media_files, digests)
+        )
+        utils.move_files(db, output_directory, logger)
+        assert db["file_store"].count == 3
+
+        objects = [output_directory / digest[:2] / digest for digest in digests]
+        objects[1].write_bytes(b"corrupt")
+        objects[2].unlink()
+        deleteable_files = utils.move_files(db, output_directory, logger)
+        assert deleteable_files == media_files[:3]
+        assert objects[1].read_bytes() == b"corrupt"
+        invalid_digests = utils.verify_media_store(
+            db, output_directory, logger, sample=3
+        )
+        assert sorted(invalid_digests) == sorted(digests[1:])
+
+        utils.move_files(db, output_directory, logger)
+        assert utils.verify_media_store(db, output_directory, logger) == []
+        assert objects[1].read_bytes() == media_files[1].read_bytes()
@@ -1,10 +1,12 @@
 import datetime
+import pathlib
 import pytest
 import logging
 import zoneinfo
 from unittest import mock
 
 from whatsapp_to_sqlite import utils
+from whatsapp_to_sqlite.parser import NoMatch
 from whatsapp_to_sqlite.messages import (
     RoomMessage,
     RoomE2EEnabledNotification
@@ -132,3 +134,126 @@ class TestParser:
         # it will become relevant it will be tested separately).
         message.full_text = None
         assert message == expected
+
+
+class TestScanner:
+    @pytest.mark.parametrize("raw, expected", LOCALE_DE)
+    def test_message_types_de_de(self, raw, expected, logger):
+        messages = utils.parse_string(raw, "de_de", logger, "scanner")
+
+        assert len(messages) == 1
+
+        message = messages[0]
+        message.full_text = None
+        assert message == expected
+
+    @pytest.mark.parametrize(
+        "chat_file",
+        sorted((pathlib.Path(__file__).parent / "logs").rglob("*.txt")),
+        ids=lambda path: path.name,
+    )
+    def test_identical_to_grammar(self, chat_file, logger):
+        string = chat_file.read_text(encoding="utf-8")
+        try:
+            expected = utils.parse_string(string, "de_de", logger)
+        except NoMatch:
+            with pytest.raises(NoMatch):
+                utils.parse_string(string, "de_de", logger, "scanner")
+            return
+
+        assert utils.parse_string(string, "de_de", logger, "scanner") == expected
+
+    @pytest.mark.parametrize(
+        "raw",
+        [
+            "Not a message\n16.01.21, 23:09 - John Doe: Hi\n",
+            "16.01.21, 23:09 - John Doe: Hi\n16.01.21, 23:10 John Doe: Hi\n",
+            "16.01.21, 23:09 - Du hast die Gruppe verlassen.\nDangling line\n",
+            "16.01.21, 23:09 - Something that is not an event.\n",
+        ],
+    )
+    def test_malformed_raises_like_grammar(self, raw, logger):
+        with pytest.raises(NoMatch):
+            utils.parse_string(raw, "de_de", logger)
+        with pytest.raises(NoMatch):
+            utils.parse_string(raw, "de_de", logger, "scanner")
+
+
+class TestCompactMessages:
+    @pytest.mark.parametrize("mode", utils.PARSER_MODES)
+    def test_without_full_text(self, mode, logger):
+        string = "".join(raw for raw, _ in LOCALE_DE)
+        expected = utils.parse_string(string, "de_de", logger, mode)
+        messages = utils.parse_string(
+            string, "de_de", logger, mode, keep_full_text=False
+        )
+
+        assert all(message.full_text is None for message in messages)
+        for message in expected:
+            message.full_text = None
+        assert messages == expected
+
+    @pytest.mark.parametrize("mode", utils.PARSER_MODES)
+    def test_slotted_and_interned(self, mode, logger):
+        string = "".join(raw for raw, _ in LOCALE_DE)
+        messages = utils.parse_string(string, "de_de", logger, mode)
+
+        assert not any(hasattr(message, "__dict__") for message in messages)
+        senders = {}
+        for message in messages:
+            if message.sender is not None:
+                assert senders.setdefault(message.sender, message.sender) is (
+                    message.sender
+                )
+
+
+class TestTimestamps:
+    @pytest.mark.parametrize("mode", utils.PARSER_MODES)
+    def test_timezone(self, mode, logger):
+        raw = "16.01.21, 23:09 - John Doe: Hi\n16.01.21, 23:09 - John Doe: Ho\n"
+
+        messages = utils.parse_string(raw, "de_de", logger, mode, timezone="UTC")
+
+        assert messages[0].timestamp == datetime.datetime(
+            2021, 1, 16, 23, 9, tzinfo=datetime.timezone.utc
+        )
+        # messages sent in the same minute share their timestamp
+        assert messages[0].timestamp is messages[1].timestamp
+        assert utils.parse_string(raw, "de_de", logger, mode)[0].timestamp == (
+            dt_help("2021-01-16T23:09")
+        )
+
+
+class TestSystemEventMatcher:
+    @pytest.mark.parametrize(
+        "event",
+        [
+            'Jane hat die Gruppe "Was hat er" erstellt.',
+            'Du hast die Gruppe "Jane hat die Gruppe "x" erstellt.',
+            "\u200eJane hat Bob hinzugefügt.",
+            "Jane hat dich hinzugefügt.",
+            "Jane hat dichte Freunde hinzugefügt.",
+            "Jane wurde hinzugefügt.",
+            "Du hast Jane hat Bob hinzugefügt.",
+            "Jane hat Bob entfernt.",
+            "Jane hat zu +49 123 gewechselt.",
+            "Jane hat seine Nummer gewechselt.",
+            'Jane hat den Betreff von "a" zu "b" geändert.',
+            "Jane hat den Betreff von „a“ zu „b“ geändert.",
+            'Du hast den Betreff zu "a" zu "b" geändert.',
+            "Du hast den Betreff von “a“ zu “b“ geändert.",
+            "Jane hat das Gruppenbild gelöscht.",
+            "Du bist jetzt ein Admin.",
+            "Jane hat etwas anderes geändert.",
+        ],
+    )
+    def test_identical_to_grammar(self, event, logger):
+        raw = f"16.01.21, 23:09 - {event}\n"
+        try:
+            expected = utils.parse_string(raw, "de_de", logger)
+        except NoMatch:
+            with pytest.raises(NoMatch):
+                utils.parse_string(raw, "de_de", logger, "scanner")
+            return
+
+        assert utils.parse_string(raw, "de_de", logger, "scanner") == expected
@@ -0,0 +1,399 @@
+"""
+Synthetic data and a benchmark runner for the import pipeline.
+
+`generate_chat_files` writes seeded de_de chat logs containing plain, multiline
+and attachment messages as well as every system event the grammar knows.
+`generate_media_tree` writes the media files referenced by those chats, plus
+unreferenced files and files with ambiguous names. `run_benchmark` measures
+parsing, saving, media import and matching on such data, each stage in a fresh
+process so that its peak memory use can be reported.
+"""
+
+import datetime
+import json
+import logging
+import multiprocessing
+import platform
+import random
+import subprocess
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import sqlite_utils
+from PIL import Image
+
+from whatsapp_to_sqlite import utils
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+# one template per alternative of `system_event` in the de_de grammar
+SYSTEM_EVENTS = [
+    '{sender} hat die Gruppe "{room}" erstellt.',
+    'Du hast die Gruppe "{room}" erstellt.',
+    "{sender} hat {target} hinzugefügt.",
+    "{target} wurde hinzugefügt.",
+    "{sender} hat dich hinzugefügt.",
+    "Du hast {target} hinzugefügt.",
+    "{sender} hat {target} entfernt.",
+    "{target} wurde entfernt.",
+    "{sender} hat dich entfernt.",
+    "Du hast {target} entfernt.",
+    "{sender} hat die Gruppe verlassen.",
+    "Du hast die Gruppe verlassen.",
+    "{sender} hat zu {number} gewechselt.",
+    "{sender} hat eine neue Telefonnummer. Tippe, um eine Nachricht zu schreiben "
+    "oder die neue Nummer hinzuzufügen.",
+    "{sender} hat ihre Nummer gewechselt.",
+    "{sender} hat seine Nummer gewechselt.",
+    '{sender} hat den Betreff von "{room}" zu "{new_room}" geändert.',
+    "{sender} hat den Betreff von „{room}“ zu „{new_room}“ geändert.",
+    '{sender} hat den Betreff zu "{new_room}" geändert.',
+    "{sender} hat den Betreff zu „{new_room}“ geändert.",
+    'Du hast den Betreff von "{room}" zu "{new_room}" geändert.',
+    "Du hast den Betreff von “{room}“ zu “{new_room}“ geändert.",
+    'Du hast den Betreff zu "{new_room}" geändert.',
+    "Du hast den Betreff zu “{new_room}“ geändert.",
+    "{sender} hat die Gruppenbeschreibung geändert.",
+    "Du hast die Gruppenbeschreibung geändert.",
+    "{sender} hat das Gruppenbild geändert.",
+    "Du hast das Gruppenbild geändert.",
+    "{sender} hat das Gruppenbild gelöscht.",
+    "Du hast das Gruppenbild gelöscht.",
+    "Du bist jetzt ein Admin.",
+    "Nachrichten, die du in diesem Chat sendest, sowie Anrufe, sind jetzt mit "
+    "Ende-zu-Ende-Verschlüsselung geschützt. Tippe für mehr Infos.",
+]
+
+FIRST_NAMES = ["Jane", "John", "Max", "Erika", "Ali", "Mia", "Jürgen", "Zoë"]
+LAST_NAMES = ["Doe", "Mustermann", "Müller", "Schmidt", "Nguyen", "Yılmaz"]
+WORDS = (
+    "hallo ja nein vielleicht morgen heute abend kino essen 😂 👍 ok "
+    "klingt gut bis später wo bist du ich komme gleich 🎉 danke super"
+).split()
+ATTACHMENT_SUFFIX = " (Datei angehängt)"
+
+# stages of `run_benchmark`, in order
+STAGES = (
+    "parse-grammar",
+    "parse-scanner",
+    "save",
+    "save-executemany",
+    "import-media",
+    "match-media",
+)
+
+
+def generate_chat_files(
+    directory: Path, messages: int, rooms: int = 1, seed: int = 0
+) -> List[Path]:
+    """
+    write `rooms` chat logs with `messages` messages in total to `directory`.
+
+    About one in twenty messages is a system event, one in ten spans multiple
+    lines and one in ten has an attachment (a few of which were excluded from
+    the export). The same seed always produces the same files.
+    """
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    senders = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    timestamp = datetime.datetime(2021, 2, 16, 8, 0)
+    attachment_number = 0
+
+    chat_files = []
+    for room_number in range(rooms):
+        room_messages = messages // rooms + (room_number < messages % rooms)
+        room_name = f"Gruppe {room_number}"
+        chat_file = directory / f"WhatsApp Chat mit {room_name}.txt"
+        with chat_file.open("w", encoding="utf-8") as file_obj:
+            for message_number in range(room_messages):
+                timestamp += datetime.timedelta(minutes=rng.randrange(0, 90))
+                prefix = timestamp.strftime("%d.%m.%y, %H:%M - ")
+                sender = rng.choice(senders)
+
+                kind = rng.random()
+                if message_number < len(SYSTEM_EVENTS) or kind < 0.05:
+                    # start each room with every system event once
+                    template = SYSTEM_EVENTS[message_number % len(SYSTEM_EVENTS)]
+                    if message_number >= len(SYSTEM_EVENTS):
+                        template = rng.choice(SYSTEM_EVENTS)
+                    line = template.format(
+                        sender=sender,
+                        target=rng.choice(senders),
+                        room=room_name,
+                        new_room=f"{room_name} {rng.choice(WORDS)}",
+                        number=f"+49 151 {rng.randrange(10 ** 8):08}",
+                    )
+                    file_obj.write(f"{prefix}{line}\n")
+                    continue
+
+                if kind < 0.15:
+                    attachment_number += 1
+                    day = timestamp.strftime("%Y%m%d")
+                    text = f"IMG-{day}-WA{attachment_number:04}.jpg{ATTACHMENT_SUFFIX}"
+                    if kind < 0.06:
+                        text = "<Medien ausgeschlossen>"
+                else:
+                    text = " ".join(rng.choices(WORDS, k=rng.randrange(1, 20)))
+
+                file_obj.write(f"{prefix}{sender}: {text}\n")
+                if rng.random() < 0.1:
+                    for _ in range(rng.randrange(1, 4)):
+                        file_obj.write(" ".join(rng.choices(WORDS, k=8)) + "\n")
+
+        chat_files.append(chat_file)
+
+    return chat_files
+
+
+def generate_media_tree(
+    directory: Path,
+    chat_files: List[Path],
+    unreferenced_files: int = 0,
+    image_size=(640, 480),
+    seed: int = 0,
+    media_scale: float = 1.0,
+) -> List[Path]:
+    """
+    write the attachments of `chat_files` as images to `directory`.
+
+    Only a `media_scale` fraction of the attachments is written, none with 0.
+    Additionally writes `unreferenced_files` files no chat refers to. Every
+    hundredth attachment also gets a different file with the same name in a
+    subdirectory, which makes its name ambiguous for `match_media_files`.
+    """
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    attachments = []
+    for chat_file in chat_files:
+        with chat_file.open(encoding="utf-8") as file_obj:
+            for line in file_obj:
+                if line.endswith(ATTACHMENT_SUFFIX + "\n"):
+                    text = line.rsplit(": ", 1)[1]
+                    attachments.append(text[: -len(ATTACHMENT_SUFFIX) - 1])
+
+    media_files = []
+    for number, name in enumerate(attachments):
+        # the same seed writes the same tree as before unless scaled down
+        if media_scale < 1 and rng.random() >= media_scale:
+            continue
+        media_file = directory / "WhatsApp Images" / name
+        media_files.append(media_file)
+        if number % 100 == 99:
+            media_files.append(directory / "WhatsApp Images" / "Sent" / name)
+
+    for number in range(unreferenced_files):
+        media_files.append(directory / "WhatsApp Documents" / f"DOC-{number:06}.pdf")
+
+    for media_file in media_files:
+        media_file.parent.mkdir(parents=True, exist_ok=True)
+        if media_file.suffix == ".jpg":
+            image = Image.frombytes(
+                "RGB", image_size, rng.randbytes(image_size[0] * image_size[1] * 3)
+            )
+            image.save(media_file, quality=85)
+        else:
+            media_file.write_bytes(rng.randbytes(rng.randrange(1024, 256 * 1024)))
+
+    return media_files
+
+
+def run_benchmark(
+    work_directory: Path,
+    messages: int,
+    rooms: int = 1,
+    unreferenced_files: int = 0,
+    seed: int = 0,
+    progress_callback=lambda *_: None,
+    media_scale: float = 1.0,
+    image_size=(640, 480),
+) -> Dict:
+    """
+    generate data in `work_directory` and measure every stage in `STAGES`.
+
+    `media_scale` and `image_size` shrink the generated media tree, see
+    `generate_media_tree`, which takes most of the disk space of large runs.
+
+    Returns the parameters and, per stage, wall and CPU time, processed items
+    and bytes, throughput and the peak resident memory of the process running
+    the stage.
+    """
+    chat_directory = work_directory / "chats"
+    media_directory = work_directory / "media"
+    chat_files = generate_chat_files(chat_directory, messages, rooms, seed)
+    generate_media_tree(
+        media_directory,
+        chat_files,
+        unreferenced_files,
+        image_size=tuple(image_size),
+        seed=seed,
+        media_scale=media_scale,
+    )
+    db_path = work_directory / "benchmark.sqlite3"
+    db_path.unlink(missing_ok=True)
+
+    results = {
+        "parameters": {
+            "messages": messages,
+            "rooms": rooms,
+            "unreferenced_files": unreferenced_files,
+            "seed": seed,
+            "media_scale": media_scale,
+            "image_size": list(image_size),
+        },
+        "environment": {
+            "commit": _get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "stages": {},
+    }
+    for stage in STAGES:
+        progress_callback(stage)
+        stage_db_path = db_path
+        if stage == "save-executemany":
+            # a database of its own, so inserts are timed into an empty
+            # database and media are matched against the rooms of "save" only
+            stage_db_path = work_directory / "benchmark-executemany.sqlite3"
+            stage_db_path.unlink(missing_ok=True)
+        # a fresh process per stage, so peak memory is not carried over
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results["stages"][stage] = executor.submit(
+                _run_stage, stage, chat_directory, media_directory, stage_db_path
+            ).result()
+
+    return results
+
+
+def compare_results(results: Dict, baseline: Dict) -> Dict[str, Optional[float]]:
+    """get the throughput of every stage relative to a saved baseline."""
+    ratios = {}
+    for stage, result in results["stages"].items():
+        baseline_result = baseline.get("stages", {}).get(stage)
+        ratios[stage] = None
+        if baseline_result and baseline_result["items_per_second"]:
+            ratios[stage] = (
+                result["items_per_second"] / baseline_result["items_per_second"]
+            )
+    return ratios
+
+
+def save_results(results: Dict, path: Path) -> None:
+    path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+def load_results(path: Path) -> Dict:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _run_stage(
+    stage: str, chat_directory: Path, media_directory: Path, db_path: Path
+) -> Dict:
+    logger = logging.getLogger(__name__)
+    chat_files = sorted(chat_directory.glob("*.txt"))
+    media_files = sorted(path for path in media_directory.rglob("*") if path.is_file())
+    db = sqlite_utils.Database(db_path)
+    utils.init_db(db, logger)
+    system_message_id = utils.get_system_message_id(db)
+
+    if stage in ("parse-grammar", "parse-scanner"):
+        mode = stage.split("-")[1]
+        measured_files = chat_files
+
+        def run():
+            return sum(
+                len(
+                    utils.parse_room_file(
+                        chat_file, "de_de", logger, mode, keep_full_text=False
+                    )
+                )
+                for chat_file in chat_files
+            )
+
+    elif stage in ("save", "save-executemany"):
+        writer = "executemany" if stage == "save-executemany" else "sqlite-utils"
+        measured_files = chat_files
+
+        def run():
+            # rooms are streamed, so huge synthetic chats fit into memory. This
+            # includes scanning them, which is fast compared to inserting.
+            sender_registry = utils.SenderRegistry(db)
+            saved_messages = 0
+            for chat_file in chat_files:
+                state = utils.save_room(
+                    utils.iter_room_file(
+                        chat_file, "de_de", logger, "scanner", keep_full_text=False
+                    ),
+                    utils.get_room_name(chat_file, "de_de"),
+                    system_message_id,
+                    db,
+                    sender_registry=sender_registry,
+                    writer=writer,
+                )
+                saved_messages += state["depth"] if state else 0
+            return saved_messages
+
+    elif stage == "import-media":
+        measured_files = media_files
+
+        def run():
+            utils.import_media_to_db(media_files, db, logger)
+            return len(media_files)
+
+    elif stage == "match-media":
+        measured_files = []
+
+        def run():
+            utils.match_media_files(db, logger)
+            return db["file_chat"].count
+
+    else:
+        raise ValueError(f"unknown benchmark stage: {stage}")
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    items = run()
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    processed_bytes = sum(path.stat().st_size for path in measured_files)
+    return {
+        "wall_seconds": wall_time,
+        "cpu_seconds": cpu_time,
+        "items": items,
+        "bytes": processed_bytes,
+        "items_per_second": items / max(wall_time, 1e-9),
+        "mb_per_second": processed_bytes / 1024**2 / max(wall_time, 1e-9),
+        "peak_rss_mb": _get_peak_rss_mb(),
+    }
+
+
+def _get_peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    if platform.system() == "Darwin":
+        return max_rss / 1024**2
+    return max_rss / 1024
+
+
+def _get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -1,16 +1,20 @@
-# pylint: disable=logging-fstring-interpolation
+# pylint: disable=logging-fstring-interpolation,import-outside-toplevel
+# rich, sqlite_utils and the benchmark are imported by the commands using them,
+# so --help and short runs do not pay for loading them.
+import contextlib
 import logging
 import locale
 import sys
+import time
+import zoneinfo
 
 from pathlib import Path
+from typing import Iterator, Optional, Tuple
 
 import click
-import rich
-import rich.progress
-import sqlite_utils
 
 from whatsapp_to_sqlite import utils
+from whatsapp_to_sqlite.metrics import Metrics
 from whatsapp_to_sqlite.parser import MessageException
 
 
@@ -55,6 +59,133 @@ def cli():
     help=("Locale for which the files will be parsed."),
     required=False,
 )
+@click.option(
+    "-t",
+    "--timezone",
+    default=utils.DEFAULT_TIMEZONE,
+    type=str,
+    help=(
+        "IANA time zone the timestamps of the chat logs are in, "
+        f"{utils.DEFAULT_TIMEZONE} by default."
+    ),
+    required=False,
+)
+@click.option(
+    "-p",
+    "--parser",
+    "parser_mode",
+    default="scanner",
+    type=click.Choice(utils.PARSER_MODES),
+    help=(
+        "Parse plain messages with a fast line scanner, or everything with the "
+        "full grammar. Both produce identical results."
+    ),
+    required=False,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    type=click.IntRange(min=1),
+    help=(
+        "Number of worker processes parsing chat files. Rooms are still "
+        "written in order by a single writer."
+    ),
+    required=False,
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help=(
+        "Parse and insert chat files message by message, keeping memory use "
+        "constant for huge chats. Cannot be combined with --jobs."
+    ),
+)
+@click.option(
+    "--writer",
+    default="executemany",
+    type=click.Choice(utils.WRITERS),
+    help=(
+        "Insert messages with prepared statements (executemany), or through "
+        "sqlite_utils. Both write identical rows."
+    ),
+    required=False,
+)
+@click.option(
+    "--queue-size",
+    default=4,
+    type=click.IntRange(min=0),
+    help=(
+        "Parse up to this many chat files ahead in a background thread while "
+        "the previous rooms are inserted, or parse and insert in turn with 0. "
+        "Not used with --stream or --profile."
+    ),
+    required=False,
+)
+@click.option(
+    "--bulk",
+    is_flag=True,
+    help=(
+        "Tune the database connection for bulk loading and commit many rooms "
+        "per transaction. Faster, but an interrupted import may lose the rooms "
+        "of the last transaction."
+    ),
+)
+@click.option(
+    "--incremental/--full",
+    default=True,
+    help=(
+        "Only import messages appended to chat files since their last import, "
+        "or import every file into a new room."
+    ),
+)
+@click.option(
+    "-b",
+    "--backup",
+    "backup_strategy",
+    default="copy",
+    type=click.Choice(utils.BACKUP_STRATEGIES),
+    help=(
+        "How to back up the database before changing it: copy the file, use "
+        "the SQLite online backup API, write a compacted copy (vacuum), only "
+        "roll back the whole import if any chat file fails, the import crashes "
+        "or is interrupted (rollback), or not at all. A finished import cannot "
+        "be rolled back."
+    ),
+    required=False,
+)
+@click.option(
+    "--keep-backups",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Delete all but this many of the most recent database backups.",
+    required=False,
+)
+@click.option(
+    "--deterministic-ids",
+    is_flag=True,
+    help=(
+        "Derive ids from chat contents and skip rows that exist already, so "
+        "importing the same chats again does not create duplicates."
+    ),
+)
+@click.option(
+    "--metrics-json",
+    "metrics_path",
+    default=None,
+    type=click.Path(dir_okay=False, resolve_path=True, path_type=Path),
+    help=(
+        "Write wall and CPU time, item and byte counts and throughput of every "
+        "import stage (in total and per chat file) as JSON to this file."
+    ),
+)
+@click.option(
+    "--profile",
+    "profile_directory",
+    default=None,
+    type=click.Path(file_okay=False, resolve_path=True, path_type=Path),
+    help="Profile every import stage and write one pstats file per stage here.",
+)
 @click.option(
     "-v",
     "--verbose",
@@ -65,6 +196,19 @@ def run_import(
     chat_files: Path,
     db_path: Path,
     locale_opt: str,
+    timezone: str,
+    parser_mode: str,
+    jobs: int,
+    stream: bool,
+    writer: str,
+    queue_size: int,
+    bulk: bool,
+    incremental: bool,
+    backup_strategy: str,
+    keep_backups: Optional[int],
+    deterministic_ids: bool,
+    metrics_path: Optional[Path],
+    profile_directory: Optional[Path],
     verbose=False,
 ):
     """
@@ -74,80 +218,237 @@ def run_import(
     Files containing chat logs must consist of one file per chat log. Its
     filename must match the pattern "WhatsApp Chat with <name>.txt"
     """
+    import rich.progress
+    import sqlite_utils
+
     loglevel = logging.INFO if not verbose else logging.DEBUG
     logging.basicConfig(format="%(message)s", level=loglevel)
     logger = logging.getLogger(__name__)
 
+    if stream and jobs > 1:
+        raise click.UsageError("--stream cannot be combined with --jobs.")
+    try:
+        zoneinfo.ZoneInfo(timezone)
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError) as exception:
+        raise click.BadParameter(
+            f"Unknown time zone {timezone}.", param_hint="--timezone"
+        ) from exception
+
     logger.debug("chats path: %s, db path: %s", chat_files, db_path)
     if db_path.exists():
-        logger.warning("Database file at %s already exists! Creating backup.", db_path)
-        utils.make_db_backup(db_path, logger)
+        if backup_strategy not in ("rollback", "none"):
+            logger.warning(
+                "Database file at %s already exists! Creating backup.", db_path
+            )
+        backup_db(db_path, logger, backup_strategy, keep_backups)
 
     db = sqlite_utils.Database(db_path)
     utils.init_db(db, logger)
+    metrics = Metrics(profile=profile_directory is not None)
 
     errors = False
     system_message_id = utils.get_system_message_id(db)
-    if chat_files.is_dir():
-        files = utils.crawl_directory_for_chat_files(chat_files, locale_opt)
-    else:
-        files = [chat_files]
-
-    with rich.progress.Progress(
-        rich.progress.SpinnerColumn(spinner_name="dots10"),
-        *rich.progress.Progress.get_default_columns(),
-        rich.progress.TimeElapsedColumn(),
-        rich.progress.TextColumn("{task.fields[room]}"),
-    ) as progress:
+    with metrics.measure("crawl") as counts:
+        if chat_files.is_dir():
+            files = utils.crawl_directory_for_chat_files(chat_files, locale_opt)
+        else:
+            files = [chat_files]
+        counts["items"] = len(files)
+
+    previous_imports = {}
+    file_digests = {}
+    if incremental:
+        with metrics.measure("previous-imports", items=len(files)):
+            previous_imports = utils.get_previous_imports(
+                files, locale_opt, db, digests=file_digests
+            )
+        unchanged_files = {
+            file
+            for file, previous_import in previous_imports.items()
+            if previous_import["size"] == file.stat().st_size
+        }
+        if unchanged_files:
+            print(f"Skipping {len(unchanged_files):n} unchanged chat files.")
+            files = [file for file in files if file not in unchanged_files]
+
+    import_context = contextlib.nullcontext(db)
+    if bulk:
+        import_context = utils.bulk_load(db, logger)
+    elif backup_strategy == "rollback":
+        import_context = utils.single_transaction(db)
+
+    imported_rooms = 0
+    imported_messages = 0
+    import_start = time.perf_counter()
+    with (
+        import_context as db,
+        rich.progress.Progress(
+            rich.progress.SpinnerColumn(spinner_name="dots10"),
+            *rich.progress.Progress.get_default_columns(),
+            rich.progress.TimeElapsedColumn(),
+            rich.progress.TextColumn("{task.fields[room]}"),
+        ) as progress,
+    ):
+        sender_registry = utils.SenderRegistry(db, deterministic_ids)
         padding = " " * 19
         all_files = progress.add_task("Import progress", total=len(files), room="")
         current_file_save = progress.add_task(padding, room="")
+        # profiles only cover the main thread, so do not parse in the background
+        pipeline_stats = None
+        pipeline = None
+        if queue_size and not stream and profile_directory is None:
+            pipeline_stats = utils.PipelineStats(queue_size)
+            pipeline = progress.add_task("Parse queue", total=queue_size, room="")
 
         print(f"Parsing {len(files):n} chat files.")
-        for file in files:
+
+        def show_pipeline():
+            if pipeline_stats and pipeline is not None:
+                progress.update(
+                    pipeline,
+                    completed=pipeline_stats.queued,
+                    room=pipeline_stats.describe(),
+                )
+
+        def save_progress():
+            progress.update(
+                current_file_save,
+                advance=1,
+                room="",
+                description="Inserting",
+            )
+            show_pipeline()
+
+        offsets = {
+            file: previous_import["size"]
+            for file, previous_import in previous_imports.items()
+        }
+        parsed_files = utils.parse_room_files(
+            files,
+            locale_opt,
+            logger,
+            parser_mode,
+            jobs,
+            offsets,
+            stream,
+            keep_full_text=False,
+            timezone=timezone,
+        )
+        if pipeline_stats:
+            parsed_files = utils.pipeline_room_files(
+                parsed_files, queue_size, offsets, metrics, pipeline_stats
+            )
+        for file, parse_room in parsed_files:
             room = None
+            metrics.set_file(file)
             try:
                 room_name = utils.get_room_name(file, locale_opt)
                 progress.update(all_files, room=room_name)
                 progress.reset(current_file_save, total=3, description="Parsing")
-                room = utils.parse_room_file(file, locale_opt, logger)
+                show_pipeline()
+                if pipeline_stats:
+                    # parsed (and measured) in the background already
+                    room = parse_room()
+                else:
+                    with metrics.measure("parse") as counts:
+                        room = parse_room()
+                        if isinstance(room, list):
+                            counts["items"] = len(room)
+                            size = file.stat().st_size
+                            counts["bytes"] = size - offsets.get(file, 0)
                 progress.advance(current_file_save)
 
             except MessageException as error:
                 logger.warning(
                     "Parsing exception:\n  In file %s:\n  %s.",
                     error.file_path,
-                    str(error.__cause__),
+                    error.reason,
                 )
                 errors = True
             except Exception as error:  # pylint: disable=broad-except
                 logger.warning("Uncaught exception during parsing: %s", str(error))
                 errors = True
             try:
-                # TODO(skowalak): Message duplicate check via cli flag?
                 progress.update(
                     current_file_save,
                     description="Processing",
                 )
-                utils.save_room(
-                    room,
-                    room_name,
-                    system_message_id,
-                    db,
-                    progress_callback=lambda: progress.update(
-                        current_file_save,
-                        advance=1,
-                        room="",
-                        description="Inserting",
-                    ),
-                )
+                previous_depth = 0
+                if file in previous_imports:
+                    previous_depth = previous_imports[file]["depth"]
+                    state = utils.append_to_room(
+                        room,
+                        previous_imports[file],
+                        system_message_id,
+                        db,
+                        progress_callback=save_progress,
+                        sender_registry=sender_registry,
+                        deterministic_ids=deterministic_ids,
+                        metrics=metrics,
+                        writer=writer,
+                    )
+                else:
+                    state = utils.save_room(
+                        room,
+                        room_name,
+                        system_message_id,
+                        db,
+                        progress_callback=save_progress,
+                        sender_registry=sender_registry,
+                        deterministic_ids=deterministic_ids,
+                        metrics=metrics,
+                        writer=writer,
+                    )
+
+                if room is not None and state:
+                    with metrics.measure("record"):
+                        utils.record_room_import(
+                            db, file, state, file_digests.get(file)
+                        )
+                    imported_messages += state["depth"] - previous_depth
+                    imported_rooms += 1
+                    if (
+                        bulk
+                        and backup_strategy != "rollback"
+                        and imported_rooms % utils.BULK_ROOMS_PER_TRANSACTION == 0
+                    ):
+                        db.conn.commit()
 
+            except MessageException as error:
+                # streamed rooms are parsed while saving
+                logger.warning(
+                    "Parsing exception:\n  In file %s:\n  %s.",
+                    error.file_path,
+                    error.reason,
+                )
+                errors = True
             except Exception as error:  # pylint: disable=broad-except
                 # FIXME(skowalak): Remove this clause completely
                 logger.error("Uncaught error while saving: %s", str(error))
                 errors = True
             progress.update(all_files, advance=1, room="")
+            metrics.set_file(None)
+
+        with metrics.measure("indexes"):
+            utils.create_indexes(db, logger)
 
+        if errors and backup_strategy == "rollback":
+            # leaves the transaction with an exception, which rolls it back
+            raise click.ClickException(
+                "Errors occurred during import, rolled back all changes.\n"
+                "Check the logs for more info, and try to run again with the -v "
+                "option."
+            )
+
+    if pipeline_stats:
+        logger.debug("Parse queue: %s", pipeline_stats.describe())
+    import_duration = time.perf_counter() - import_start
+    messages_per_second = int(imported_messages / max(import_duration, 1e-9))
+    print(
+        f"Imported {imported_messages:n} messages in {import_duration:.1f}s "
+        f"({messages_per_second:n} messages/s)."
+    )
+    write_metrics(metrics, metrics_path, profile_directory)
     if errors:
         logger.warning(
             "Warning: Errors occurred during import.\n"
@@ -156,6 +457,66 @@ def run_import(
         )
 
 
+def scan_media_files(
+    data_directory: Path,
+    logger: logging.Logger,
+    metrics: Metrics,
+    set_progress_size=lambda *_: None,
+    jobs: Optional[int] = None,
+) -> Iterator[utils.FileEntry]:
+    """yield media files as they are found, the time waited for is "crawl"."""
+    entries = utils.scan_directory(data_directory, jobs=jobs)
+    count = 0
+    wall_seconds = 0.0
+    while True:
+        start = time.perf_counter()
+        entry = next(entries, None)
+        wall_seconds += time.perf_counter() - start
+        if entry is None:
+            break
+
+        count += 1
+        yield entry
+
+    metrics.add("crawl", wall_seconds=wall_seconds, items=count)
+    logger.info(f"Found {count:n} files to import into database.")
+    set_progress_size(count)
+
+
+def write_metrics(
+    metrics: Metrics, metrics_path: Optional[Path], profile_directory: Optional[Path]
+):
+    if metrics_path:
+        metrics.write_json(metrics_path)
+        print(f"Metrics written to {metrics_path}.")
+    if profile_directory:
+        metrics.write_profiles(profile_directory)
+        print(f"Profiles written to {profile_directory}.")
+
+
+def backup_db(
+    db_path: Path, logger: logging.Logger, strategy: str, keep_backups: Optional[int]
+):
+    if strategy in ("rollback", "none"):
+        # no backup is written, but old ones are still pruned
+        utils.make_db_backup(db_path, logger, strategy, keep_backups)
+        return
+
+    import rich.progress
+
+    with rich.progress.Progress(transient=True) as progress:
+        task = progress.add_task("Backing up database", total=None)
+        utils.make_db_backup(
+            db_path,
+            logger,
+            strategy,
+            keep_backups,
+            progress_callback=lambda remaining, total: progress.update(
+                task, completed=total - remaining, total=total
+            ),
+        )
+
+
 @cli.command(name="import-media")
 @click.argument(
     "data_directory",
@@ -185,6 +546,91 @@ def run_import(
     help="Write paths of copied files to this file.",
     required=False,
 )
+@click.option(
+    "-j",
+    "--jobs",
+    default=None,
+    type=click.IntRange(min=1),
+    help=(
+        "Number of threads hashing, previewing and copying media files. "
+        "Defaults to the number of CPUs plus four."
+    ),
+    required=False,
+)
+@click.option(
+    "-s",
+    "--strategy",
+    default="copy",
+    type=click.Choice(utils.COPY_STRATEGIES),
+    help=(
+        "How to put media files into the output directory. Links are much "
+        "faster, but require the output directory on the same filesystem "
+        "(hardlink) or keeping the original files (symlink). reflink falls "
+        "back to copy if the filesystem does not support it."
+    ),
+    required=False,
+)
+@click.option(
+    "-b",
+    "--backup",
+    "backup_strategy",
+    default="copy",
+    type=click.Choice(utils.BACKUP_STRATEGIES),
+    help=(
+        "How to back up the database before changing it: copy the file, use "
+        "the SQLite online backup API, write a compacted copy (vacuum), only "
+        "roll back the database changes if the import crashes or is "
+        "interrupted (rollback, copied files are kept), or not at all. A "
+        "finished import cannot be rolled back."
+    ),
+    required=False,
+)
+@click.option(
+    "--keep-backups",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Delete all but this many of the most recent database backups.",
+    required=False,
+)
+@click.option(
+    "--rehash",
+    is_flag=True,
+    help=(
+        "Hash every media file again, even if it did not change since it was "
+        "last imported."
+    ),
+)
+@click.option(
+    "--referenced-only",
+    is_flag=True,
+    help=(
+        "Only import media files whose names occur in imported chats. Other "
+        "files are skipped without being read."
+    ),
+)
+@click.option(
+    "--defer-previews",
+    is_flag=True,
+    help="Do not generate previews while importing. Run generate-previews afterwards.",
+)
+@click.option(
+    "--metrics-json",
+    "metrics_path",
+    default=None,
+    type=click.Path(dir_okay=False, resolve_path=True, path_type=Path),
+    help=(
+        "Write wall and CPU time, item and byte counts and throughput of every "
+        "media import stage in total, and of hashing and previewing per media "
+        "file, as JSON to this file."
+    ),
+)
+@click.option(
+    "--profile",
+    "profile_directory",
+    default=None,
+    type=click.Path(file_okay=False, resolve_path=True, path_type=Path),
+    help="Profile every import stage and write one pstats file per stage here.",
+)
 @click.option(
     "-v",
     "--verbose",
@@ -196,6 +642,15 @@ def run_media_import(
     db_path: Path,
     output_directory: Path,
     list_path: Path,
+    jobs: Optional[int],
+    strategy: str,
+    backup_strategy: str,
+    keep_backups: Optional[int],
+    rehash: bool,
+    referenced_only: bool,
+    defer_previews: bool,
+    metrics_path: Optional[Path],
+    profile_directory: Optional[Path],
     verbose=False,
 ):
     """
@@ -205,6 +660,9 @@ def run_media_import(
     If an output directory is specified, imported media will be renamed and
     copied there.
     """
+    import rich.progress
+    import sqlite_utils
+
     loglevel = logging.DEBUG if verbose else logging.INFO
     logging.basicConfig(format="%(message)s", level=loglevel)
     logger = logging.getLogger(__name__)
@@ -213,9 +671,10 @@ def run_media_import(
 
     logger.debug("db path: %s, data dir: %s", db_path, data_directory)
     logger.debug(
-        "options: output_dir: %s, list_path: %s, verbose %s",
+        "options: output_dir: %s, list_path: %s, jobs: %s, verbose %s",
         output_directory,
         list_path,
+        jobs,
         verbose,
     )
 
@@ -224,74 +683,387 @@ def run_media_import(
         sys.exit(-1)
 
     logger.info("Database found at %s.", db_path)
-    utils.make_db_backup(db_path, logger)
+    backup_db(db_path, logger, backup_strategy, keep_backups)
     db = sqlite_utils.Database(db_path)
+    utils.init_db(db, logger)
 
     if not (data_directory and data_directory.exists()):
         logger.error("data_directory %s does not exist.", data_directory)
         sys.exit(-1)
 
+    metrics = Metrics(profile=profile_directory is not None)
     logger.debug("Data directory %s specified. Searching now.", data_directory)
-    files = utils.crawl_directory(data_directory)
-    len_files = len(files)
-    logger.info(f"Importing {len_files:n} files into database.")
-
-    with rich.progress.Progress(
-        rich.progress.SpinnerColumn(spinner_name="dots10"),
-        rich.progress.TextColumn(
-            "[progress.description]{task.description}", justify="right"
-        ),
-        rich.progress.BarColumn(),
-        rich.progress.TaskProgressColumn(),
-        rich.progress.TimeRemainingColumn(),
-        rich.progress.TimeElapsedColumn(),
-    ) as progress:
+
+    import_context = contextlib.nullcontext(db)
+    if backup_strategy == "rollback":
+        import_context = utils.single_transaction(db)
+
+    with (
+        import_context as db,
+        rich.progress.Progress(
+            rich.progress.SpinnerColumn(spinner_name="dots10"),
+            rich.progress.TextColumn(
+                "[progress.description]{task.description}", justify="right"
+            ),
+            rich.progress.BarColumn(),
+            rich.progress.TaskProgressColumn(),
+            rich.progress.TimeRemainingColumn(),
+            rich.progress.TimeElapsedColumn(),
+        ) as progress,
+    ):
 
         padding = " " * 19
         all_steps = progress.add_task("All Tasks", total=4)
-        import_step = progress.add_task(padding, total=len(files), start=False)
+        import_step = progress.add_task(padding, total=None, start=False)
         dedup_step = progress.add_task(padding, total=1, start=False)
-        match_step = progress.add_task(padding, total=len(files), start=False)
-        move_step = progress.add_task(padding, total=len(files), start=False)
+        match_step = progress.add_task(padding, total=None, start=False)
+        move_step = progress.add_task(padding, total=None, start=False)
 
         progress.start_task(import_step)
         progress.update(import_step, description="Importing")
+        # files are imported while the directory is still being scanned, the
+        # total is known once the scan is done.
+        files = scan_media_files(
+            data_directory,
+            logger,
+            metrics,
+            set_progress_size=lambda size: progress.update(import_step, total=size),
+            jobs=jobs,
+        )
         utils.import_media_to_db(
             files,
             db,
             logger,
             progress_callback=lambda: progress.advance(import_step),
+            jobs=jobs,
+            use_cache=not rehash,
+            referenced_only=referenced_only,
+            previews=not defer_previews,
+            metrics=metrics,
         )
-        progress.advance(import_step, advance=len(files))
+        with metrics.measure("indexes"):
+            utils.create_indexes(db, logger)
         progress.advance(all_steps)
 
         progress.start_task(dedup_step)
         progress.update(dedup_step, description="Removing Duplicates")
-        removed_files = utils.remove_media_duplicates(db)
+        with metrics.measure("dedup") as counts:
+            removed_files = utils.remove_media_duplicates(db)
+            counts["items"] = removed_files
         print(f"Removed {removed_files:n} duplicate files.")
         progress.update(dedup_step, completed=1.0)
         progress.advance(all_steps)
 
         progress.start_task(match_step)
         progress.update(match_step, description="Matching")
-        utils.match_media_files(
-            db,
-            logger,
-            set_progress_size=lambda size: progress.update(match_step, total=size),
-            progress_callback=lambda: progress.advance(match_step),
-        )
+        with metrics.measure("match", items=db["file_chat"].count):
+            utils.match_media_files(
+                db,
+                logger,
+                set_progress_size=lambda size: progress.update(match_step, total=size),
+                progress_callback=lambda: progress.advance(match_step),
+            )
         progress.advance(all_steps)
 
         progress.start_task(move_step)
         progress.update(move_step, description="Copying Files")
-        deleteable_files = utils.move_files(
+        with metrics.measure("copy") as counts:
+            deleteable_files = utils.move_files(
+                db,
+                output_directory,
+                logger,
+                set_progress_size=lambda size: progress.update(move_step, total=size),
+                progress_callback=lambda: progress.advance(move_step),
+                strategy=strategy,
+                jobs=jobs,
+            )
+            counts["items"] = len(deleteable_files)
+        progress.advance(all_steps)
+
+        utils.write_list_of_files(deleteable_files, list_path)
+        print(f"Copied {len(deleteable_files)}. List written to {list_path}.")
+
+    write_metrics(metrics, metrics_path, profile_directory)
+
+
+@cli.command(name="verify")
+@click.argument(
+    "db_path",
+    default="messagedb.sqlite3",
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True, path_type=Path),
+    required=False,
+)
+@click.option(
+    "-o",
+    "--output-directory",
+    default="messagedb_files",
+    type=click.Path(file_okay=False, resolve_path=True, path_type=Path),
+    help=("Path to directory, where processed media were copied to."),
+    required=False,
+)
+@click.option(
+    "--sample",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Only check this many randomly chosen files.",
+    required=False,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of threads hashing files. Defaults to the number of CPUs plus four.",
+    required=False,
+)
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    help="Be more verbose when logging errors.",
+)
+def run_verify(
+    db_path: Path,
+    output_directory: Path,
+    sample: Optional[int],
+    jobs: Optional[int],
+    verbose=False,
+):
+    """
+    Check that the media files copied to the output directory by import-media
+    are complete and unchanged.
+
+    Missing or corrupt files are copied again by the next import-media run.
+    """
+    import rich.progress
+    import sqlite_utils
+
+    loglevel = logging.DEBUG if verbose else logging.INFO
+    logging.basicConfig(format="%(message)s", level=loglevel)
+    logger = logging.getLogger(__name__)
+
+    db = sqlite_utils.Database(db_path)
+    utils.init_db(db, logger)
+
+    with rich.progress.Progress() as progress:
+        task = progress.add_task("Verifying", total=None)
+        invalid_digests = utils.verify_media_store(
             db,
             output_directory,
             logger,
-            set_progress_size=lambda size: progress.update(move_step, total=size),
-            progress_callback=lambda: progress.advance(move_step),
+            set_progress_size=lambda size: progress.update(task, total=size),
+            progress_callback=lambda: progress.advance(task),
+            sample=sample,
+            jobs=jobs,
         )
-        progress.advance(all_steps)
 
-        utils.write_list_of_files(deleteable_files, list_path)
-        print(f"Copied {len(deleteable_files)}. List written to {list_path}.")
+    if invalid_digests:
+        raise click.ClickException(
+            f"{len(invalid_digests):n} files are missing or corrupt. Run "
+            "import-media again to restore them."
+        )
+    print("All checked files are intact.")
+
+
+@cli.command(name="generate-previews")
+@click.argument(
+    "db_path",
+    default="messagedb.sqlite3",
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True, path_type=Path),
+    required=False,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of worker processes. Defaults to the number of CPUs.",
+    required=False,
+)
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    help="Be more verbose when logging errors.",
+)
+def run_generate_previews(db_path: Path, jobs: Optional[int], verbose=False):
+    """
+    Generate previews of imported media files that do not have one yet, e.g.
+    after running import-media with --defer-previews.
+    """
+    import rich.progress
+    import sqlite_utils
+
+    loglevel = logging.DEBUG if verbose else logging.INFO
+    logging.basicConfig(format="%(message)s", level=loglevel)
+    logger = logging.getLogger(__name__)
+
+    db = sqlite_utils.Database(db_path)
+    utils.init_db(db, logger)
+
+    with rich.progress.Progress() as progress:
+        task = progress.add_task("Generating Previews", total=None)
+        generated_previews = utils.generate_previews(
+            db,
+            logger,
+            set_progress_size=lambda size: progress.update(task, total=size),
+            progress_callback=lambda: progress.advance(task),
+            jobs=jobs,
+        )
+
+    print(f"Generated {generated_previews:n} previews.")
+
+
+@cli.command(name="optimize")
+@click.argument(
+    "db_path",
+    default="messagedb.sqlite3",
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True, path_type=Path),
+    required=False,
+)
+@click.option(
+    "--vacuum",
+    is_flag=True,
+    help="Rebuild the database file to reclaim unused space. Can take a while.",
+)
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    help="Be more verbose when logging errors.",
+)
+def run_optimize(db_path: Path, vacuum: bool, verbose=False):
+    """
+    Create missing indexes and update query planner statistics of the SQLite3
+    message database at DB_PATH.
+    """
+    import sqlite_utils
+
+    loglevel = logging.DEBUG if verbose else logging.INFO
+    logging.basicConfig(format="%(message)s", level=loglevel)
+    logger = logging.getLogger(__name__)
+
+    size_before = db_path.stat().st_size
+    db = sqlite_utils.Database(db_path)
+    utils.optimize_db(db, logger, vacuum)
+    db.close()
+    size_after = db_path.stat().st_size
+
+    print(
+        f"Optimized {db_path}: {size_before / 1024 ** 2:,.1f} MiB -> "
+        f"{size_after / 1024 ** 2:,.1f} MiB."
+    )
+
+
+@cli.command(name="benchmark")
+@click.argument(
+    "work_directory",
+    type=click.Path(file_okay=False, resolve_path=True, path_type=Path),
+    required=True,
+)
+@click.option(
+    "-m",
+    "--messages",
+    default=10_000,
+    type=click.IntRange(min=1),
+    help="Number of generated chat messages.",
+)
+@click.option(
+    "-r",
+    "--rooms",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of chat files the messages are spread over.",
+)
+@click.option(
+    "--unreferenced-files",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Number of generated media files no chat refers to.",
+)
+@click.option(
+    "--media-scale",
+    default=1.0,
+    type=click.FloatRange(min=0, max=1),
+    help=(
+        "Fraction of the attachments written as media files, 0 for none. "
+        "Use a small fraction for large runs."
+    ),
+)
+@click.option(
+    "--image-size",
+    default=(640, 480),
+    type=(click.IntRange(min=1), click.IntRange(min=1)),
+    help="Width and height of the generated images.",
+)
+@click.option(
+    "--seed",
+    default=0,
+    type=int,
+    help="Seed of the data generator. Compare results with the same seed only.",
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_path",
+    default=None,
+    type=click.Path(dir_okay=False, resolve_path=True, path_type=Path),
+    help="Save the results as JSON, e.g. as a baseline for later runs.",
+)
+@click.option(
+    "-b",
+    "--baseline",
+    "baseline_path",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True, path_type=Path),
+    help="Compare throughput to results saved with --output.",
+)
+def run_benchmark(
+    work_directory: Path,
+    messages: int,
+    rooms: int,
+    unreferenced_files: int,
+    media_scale: float,
+    image_size: Tuple[int, int],
+    seed: int,
+    output_path: Optional[Path],
+    baseline_path: Optional[Path],
+):
+    """
+    Generate synthetic chats and media in WORK_DIRECTORY and measure the
+    throughput and peak memory use of every import stage.
+    """
+    from whatsapp_to_sqlite import benchmark
+
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    results = benchmark.run_benchmark(
+        work_directory,
+        messages,
+        rooms,
+        unreferenced_files,
+        seed,
+        progress_callback=lambda stage: print(f"Running {stage}."),
+        media_scale=media_scale,
+        image_size=image_size,
+    )
+
+    ratios = {}
+    if baseline_path:
+        ratios = benchmark.compare_results(
+            results, benchmark.load_results(baseline_path)
+        )
+
+    for stage, result in results["stages"].items():
+        line = (
+            f"{stage:>17}: {result['wall_seconds']:8.2f}s "
+            f"{result['items_per_second']:12,.0f} items/s "
+            f"{result['mb_per_second']:8.1f} MB/s "
+            f"{result['peak_rss_mb'] or 0:8.1f} MB peak RSS"
+        )
+        if ratios.get(stage):
+            line += f" ({ratios[stage]:.2f}x baseline)"
+        print(line)
+
+    if output_path:
+        benchmark.save_results(results, output_path)
+        print(f"Results written to {output_path}.")
@@ -1,12 +1,16 @@
 """
 Messages
+
+Messages are slotted dataclasses, since chat logs can hold millions of them.
+The mixins below define empty `__slots__` so subclasses do not get a
+`__dict__` through them.
 """
 
 from dataclasses import dataclass, asdict, replace
 from datetime import datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     timestamp: datetime = None
     full_text: str = None
@@ -22,7 +26,7 @@ class Message:
         return replace(self, **changes)
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomMessage(Message):
     text: str = None
     continued_text: str = None
@@ -31,7 +35,7 @@ class RoomMessage(Message):
     file: bool = False
 
 
-@dataclass
+@dataclass(slots=True)
 class SystemMessage(Message):
     target: str = None
     new_number: str = None
@@ -39,132 +43,132 @@ class SystemMessage(Message):
 
 
 class HasTargetUserMessage:
-    pass
+    __slots__ = ()
 
 
 class HasNewRoomNameMessage:
-    pass
+    __slots__ = ()
 
 
 class HasNewNumberMessage:
-    pass
+    __slots__ = ()
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomCreateByThirdParty(SystemMessage, HasNewRoomNameMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomCreateBySelf(SystemMessage, HasNewRoomNameMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomJoinThirdPartyByThirdParty(SystemMessage, HasTargetUserMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomJoinThirdPartyByUnknown(SystemMessage, HasTargetUserMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomJoinSelfByThirdParty(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomJoinThirdPartyBySelf(SystemMessage, HasTargetUserMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomKickThirdPartyByThirdParty(SystemMessage, HasTargetUserMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomKickThirdPartyByUnknown(SystemMessage, HasTargetUserMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomKickSelfByThirdParty(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomKickThirdPartyBySelf(SystemMessage, HasTargetUserMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomLeaveThirdParty(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomLeaveSelf(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomNameBySelf(SystemMessage, HasNewRoomNameMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomNameByThirdParty(SystemMessage, HasNewRoomNameMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomDescriptionBySelf(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomDescriptionByThirdParty(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomAvatarChangeBySelf(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomAvatarChangeByThirdParty(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomAvatarDeleteBySelf(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomAvatarDeleteByThirdParty(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomAdminPromotion(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomNumberChangeWithNumber(SystemMessage, HasNewNumberMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomNumberChangeWithoutNumber(SystemMessage):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomE2EEnabledNotification(SystemMessage):
     pass
@@ -0,0 +1,133 @@
+"""
+Per-stage timing and throughput of imports.
+
+Import functions record how long each stage (parsing, preparing, inserting,
+hashing, ...) took and how many items and bytes it processed in a `Metrics`
+object. Stages measured while a chat file is being imported are also recorded
+for that file. Optionally, every stage running on the main thread is profiled
+with cProfile.
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+
+class Metrics:
+    def __init__(self, profile: bool = False):
+        self.profile = profile
+        self._stages = {}
+        self._files = {}
+        self._profilers = {}
+        self._profiling = False
+        self._current = threading.local()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def set_file(self, file: Optional[Path]) -> None:
+        """attribute stages measured by this thread to a chat file, or none."""
+        self._current.file = str(file) if file else None
+
+    @contextlib.contextmanager
+    def measure(self, stage: str, items: int = 0, size: int = 0) -> Iterator[Dict]:
+        """
+        measure a stage, yields a dict whose "items" and "bytes" counts can be
+        updated while the stage runs.
+
+        CPU time is that of the measuring thread, so stages running in worker
+        threads can be measured on their own.
+        """
+        counts = {"items": items, "bytes": size}
+        profiler = self._start_profiler(stage)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield counts
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.thread_time() - cpu_start
+            if profiler:
+                profiler.disable()
+                self._profiling = False
+            self.add(stage, wall_seconds, cpu_seconds, counts["items"], counts["bytes"])
+
+    def add(
+        self,
+        stage: str,
+        wall_seconds: float = 0.0,
+        cpu_seconds: float = 0.0,
+        items: int = 0,
+        size: int = 0,
+    ) -> None:
+        file = getattr(self._current, "file", None)
+        with self._lock:
+            targets = [self._stages]
+            if file:
+                targets.append(self._files.setdefault(file, {}))
+            for stages in targets:
+                totals = stages.setdefault(
+                    stage,
+                    {
+                        "calls": 0,
+                        "wall_seconds": 0.0,
+                        "cpu_seconds": 0.0,
+                        "items": 0,
+                        "bytes": 0,
+                    },
+                )
+                totals["calls"] += 1
+                totals["wall_seconds"] += wall_seconds
+                totals["cpu_seconds"] += cpu_seconds
+                totals["items"] += items
+                totals["bytes"] += size
+
+    def to_dict(self) -> Dict:
+        return {
+            "wall_seconds": time.perf_counter() - self._start,
+            "stages": _with_throughput(self._stages),
+            "files": {
+                file: _with_throughput(stages) for file, stages in self._files.items()
+            },
+        }
+
+    def write_json(self, path: Path) -> None:
+        path.write_text(json.dumps(self.to_dict(), indent=2), encoding="utf-8")
+
+    def write_profiles(self, directory: Path) -> None:
+        """write one pstats file per profiled stage to `directory`."""
+        directory.mkdir(parents=True, exist_ok=True)
+        for stage, profiler in self._profilers.items():
+            profiler.dump_stats(directory / f"{stage}.pstats")
+
+    def _start_profiler(self, stage: str) -> Optional["cProfile.Profile"]:
+        # cProfile only sees the thread it was enabled on, and only one
+        # profiler can be active at a time, so nested stages are not profiled.
+        if (
+            not self.profile
+            or threading.current_thread() is not threading.main_thread()
+            or self._profiling
+        ):
+            return None
+
+        import cProfile  # pylint: disable=import-outside-toplevel
+
+        profiler = self._profilers.setdefault(stage, cProfile.Profile())
+        self._profiling = True
+        profiler.enable()
+        return profiler
+
+
+def _with_throughput(stages: Dict) -> Dict:
+    result = {}
+    for stage, totals in stages.items():
+        wall_seconds = max(totals["wall_seconds"], 1e-9)
+        result[stage] = {
+            **totals,
+            "items_per_second": totals["items"] / wall_seconds,
+            "mb_per_second": totals["bytes"] / 1024**2 / wall_seconds,
+        }
+    return result
@@ -1,15 +1,39 @@
+# pylint: disable=import-outside-toplevel
+from __future__ import annotations
+
 import re
+from typing import TYPE_CHECKING
+
+from whatsapp_to_sqlite.parser.base import DEFAULT_TIMEZONE, MessageException
 
-from whatsapp_to_sqlite.parser.parser_de_de import (
-    MessageException,
-    MessageParser,
-    MessageVisitor,
-    NoMatch,
-    log,
-    visit_parse_tree,
+if TYPE_CHECKING:
+    from whatsapp_to_sqlite.parser.parser_de_de import MessageParser
+    from whatsapp_to_sqlite.parser.scanner_de_de import MessageScanner
+
+# the grammar (and arpeggio) is only imported once one of its names is used
+_GRAMMAR_NAMES = (
+    "MessageParser",
+    "MessageVisitor",
+    "NoMatch",
+    "log",
+    "visit_parse_tree",
 )
 
 
+def __getattr__(name: str):
+    if name in _GRAMMAR_NAMES:
+        from whatsapp_to_sqlite.parser import parser_de_de
+
+        return getattr(parser_de_de, name)
+
+    if name == "MessageScanner":
+        from whatsapp_to_sqlite.parser.scanner_de_de import MessageScanner
+
+        return MessageScanner
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def get_room_name_by_locale(room_file_name: str, locale: str) -> str:
     """
     get the name of a room from the file name of the chat log.
@@ -35,6 +59,18 @@ def get_chat_file_glob_by_locale(locale: str) -> str:
 def get_parser_by_locale(locale: str) -> MessageParser:
     """get a message parser for the appropriate locale (and language)."""
     if locale == "de_de":
+        from whatsapp_to_sqlite.parser.parser_de_de import MessageParser
+
         return MessageParser
 
     raise NotImplementedError(f"No parser for locale {locale} could be found.")
+
+
+def get_scanner_by_locale(locale: str) -> MessageScanner:
+    """get a line-oriented fast path message scanner for the locale."""
+    if locale == "de_de":
+        from whatsapp_to_sqlite.parser.scanner_de_de import MessageScanner
+
+        return MessageScanner
+
+    raise NotImplementedError(f"No scanner for locale {locale} could be found.")
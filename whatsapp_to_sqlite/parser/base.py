@@ -1,2 +1,14 @@
+"""
+Parts of the parser that do not depend on a locale or on arpeggio.
+"""
 
+DEFAULT_TIMEZONE = "Europe/Berlin"
 
+
+class MessageException(Exception):
+    def __init__(self, file_path, reason=None):
+        # keep everything in args, so the exception survives pickling when
+        # files are parsed in worker processes.
+        super().__init__(file_path, reason)
+        self.file_path = file_path
+        self.reason = reason
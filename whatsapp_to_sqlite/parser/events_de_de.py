@@ -0,0 +1,320 @@
+"""
+Table-driven matcher for de_de system events.
+
+`system_event` in the grammar is an ordered choice over all events, and most
+of them start by scanning for " hat", so a system line may be scanned once per
+event before it matches. Here every event is a single compiled regular
+expression, and events are indexed by their last word ("erstellt.",
+"hinzugefügt.", "geändert.", ...), so a line is only matched against the few
+events that end the same way.
+
+The expressions follow the grammar part by part, including arpeggio's
+non-backtracking `.+?(?=...)` matches, and events sharing a last word are
+tried in grammar order. Matched messages (and their `full_text`) are identical
+to the ones the grammar produces.
+"""
+
+import collections
+import re
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+from whatsapp_to_sqlite.messages import (
+    Message,
+    RoomAdminPromotion,
+    RoomAvatarChangeBySelf,
+    RoomAvatarChangeByThirdParty,
+    RoomAvatarDeleteBySelf,
+    RoomAvatarDeleteByThirdParty,
+    RoomCreateBySelf,
+    RoomCreateByThirdParty,
+    RoomDescriptionBySelf,
+    RoomDescriptionByThirdParty,
+    RoomE2EEnabledNotification,
+    RoomJoinSelfByThirdParty,
+    RoomJoinThirdPartyBySelf,
+    RoomJoinThirdPartyByThirdParty,
+    RoomJoinThirdPartyByUnknown,
+    RoomKickSelfByThirdParty,
+    RoomKickThirdPartyBySelf,
+    RoomKickThirdPartyByThirdParty,
+    RoomKickThirdPartyByUnknown,
+    RoomLeaveSelf,
+    RoomLeaveThirdParty,
+    RoomNameBySelf,
+    RoomNameByThirdParty,
+    RoomNumberChangeWithNumber,
+    RoomNumberChangeWithoutNumber,
+)
+
+
+class _Until(str):
+    """`.+?(?=...)` in the grammar: the text up to the first lookahead."""
+
+
+class _Not(str):
+    """`Not(...)` in the grammar."""
+
+
+def _name(name: str) -> str:
+    # FIXME(skowalak): Find out for which messages the U+200E applies
+    return sys.intern(name.lstrip("\u200e"))
+
+
+# events in the order of `system_event`, with the parts of their grammar rule
+# and a function making a message from the text matched by `_Until` parts.
+SYSTEM_EVENTS: List[Tuple[Tuple[str, ...], Callable[..., Message]]] = [
+    (
+        (_Until(" hat"), ' hat die Gruppe "', _Until('" erstellt'), '" erstellt.\n'),
+        lambda sender, name: RoomCreateByThirdParty(
+            sender=_name(sender), new_room_name=name
+        ),
+    ),
+    (
+        ('Du hast die Gruppe "', _Until('" erstellt'), '" erstellt.\n'),
+        lambda name: RoomCreateBySelf(new_room_name=name),
+    ),
+    (
+        (
+            _Until(" hat"),
+            " hat ",
+            _Not("dich"),
+            _Until(" hinzugefügt"),
+            " hinzugefügt.\n",
+        ),
+        lambda sender, target: RoomJoinThirdPartyByThirdParty(
+            sender=_name(sender), target=sys.intern(target)
+        ),
+    ),
+    (
+        (_Until(" wurde"), " wurde hinzugefügt.\n"),
+        lambda target: RoomJoinThirdPartyByUnknown(target=sys.intern(target)),
+    ),
+    (
+        (_Until(" hat"), " hat dich hinzugefügt.\n"),
+        lambda sender: RoomJoinSelfByThirdParty(sender=_name(sender)),
+    ),
+    (
+        ("Du hast ", _Until(" hinzugefügt"), " hinzugefügt.\n"),
+        lambda target: RoomJoinThirdPartyBySelf(target=sys.intern(target)),
+    ),
+    (
+        (_Until(" hat"), " hat ", _Not("dich"), _Until(" entfernt"), " entfernt.\n"),
+        lambda sender, target: RoomKickThirdPartyByThirdParty(
+            sender=sys.intern(sender), target=sys.intern(target)
+        ),
+    ),
+    (
+        (_Until(" wurde"), " wurde entfernt.\n"),
+        lambda target: RoomKickThirdPartyByUnknown(target=sys.intern(target)),
+    ),
+    (
+        (_Until(" hat"), " hat dich entfernt.\n"),
+        lambda sender: RoomKickSelfByThirdParty(sender=sys.intern(sender)),
+    ),
+    (
+        ("Du hast ", _Until(" entfernt"), " entfernt.\n"),
+        lambda target: RoomKickThirdPartyBySelf(target=sys.intern(target)),
+    ),
+    (
+        (_Until(" hat"), " hat die Gruppe verlassen.\n"),
+        lambda sender: RoomLeaveThirdParty(sender=sys.intern(sender)),
+    ),
+    (
+        ("Du hast die Gruppe verlassen.\n",),
+        RoomLeaveSelf,
+    ),
+    (
+        (_Until(" hat"), " hat zu ", _Until(" gewechselt"), " gewechselt.\n"),
+        lambda sender, number: RoomNumberChangeWithNumber(
+            sender=sys.intern(sender), new_number=number
+        ),
+    ),
+    *(
+        (
+            (_Until(" hat"), text),
+            lambda sender: RoomNumberChangeWithoutNumber(sender=sys.intern(sender)),
+        )
+        for text in (
+            (
+                " hat eine neue Telefonnummer. Tippe, um eine Nachricht zu "
+                "schreiben oder die neue Nummer hinzuzufügen.\n"
+            ),
+            " hat ihre Nummer gewechselt.\n",
+            " hat seine Nummer gewechselt.\n",
+        )
+    ),
+    (
+        (
+            _Until(" hat"),
+            ' hat den Betreff von "',
+            _Until('" zu'),
+            '" zu "',
+            _Until('" geändert'),
+            '" geändert.\n',
+        ),
+        lambda sender, _, name: RoomNameByThirdParty(
+            sender=sys.intern(sender), new_room_name=name
+        ),
+    ),
+    (
+        (
+            _Until(" hat"),
+            " hat den Betreff von „",
+            _Until("“ zu"),
+            "“ zu „",
+            _Until("“ geändert"),
+            "“ geändert.\n",
+        ),
+        lambda sender, _, name: RoomNameByThirdParty(
+            sender=sys.intern(sender), new_room_name=name
+        ),
+    ),
+    (
+        (
+            _Until(" hat"),
+            ' hat den Betreff zu "',
+            _Until('" geändert'),
+            '" geändert.\n',
+        ),
+        lambda sender, name: RoomNameByThirdParty(
+            sender=sys.intern(sender), new_room_name=name
+        ),
+    ),
+    (
+        (
+            _Until(" hat"),
+            " hat den Betreff zu „",
+            _Until("“ geändert"),
+            "“ geändert.\n",
+        ),
+        lambda sender, name: RoomNameByThirdParty(
+            sender=sys.intern(sender), new_room_name=name
+        ),
+    ),
+    (
+        (
+            'Du hast den Betreff von "',
+            _Until('" zu'),
+            '" zu "',
+            _Until('" geändert'),
+            '" geändert.\n',
+        ),
+        lambda _, name: RoomNameBySelf(new_room_name=name),
+    ),
+    (
+        (
+            "Du hast den Betreff von “",
+            _Until("“ zu"),
+            "“ zu “",
+            _Until("“ geändert"),
+            "“ geändert.\n",
+        ),
+        lambda _, name: RoomNameBySelf(new_room_name=name),
+    ),
+    (
+        ('Du hast den Betreff zu "', _Until('" geändert'), '" geändert.\n'),
+        lambda name: RoomNameBySelf(new_room_name=name),
+    ),
+    (
+        ("Du hast den Betreff zu “", _Until("“ geändert"), "“ geändert.\n"),
+        lambda name: RoomNameBySelf(new_room_name=name),
+    ),
+    (
+        (_Until(" hat"), " hat die Gruppenbeschreibung geändert.\n"),
+        lambda sender: RoomDescriptionByThirdParty(sender=sys.intern(sender)),
+    ),
+    (
+        ("Du hast die Gruppenbeschreibung geändert.\n",),
+        RoomDescriptionBySelf,
+    ),
+    (
+        (_Until(" hat"), " hat das Gruppenbild geändert.\n"),
+        lambda sender: RoomAvatarChangeByThirdParty(sender=_name(sender)),
+    ),
+    (
+        ("Du hast das Gruppenbild geändert.\n",),
+        RoomAvatarChangeBySelf,
+    ),
+    (
+        (_Until(" hat"), " hat das Gruppenbild gelöscht.\n"),
+        lambda sender: RoomAvatarDeleteByThirdParty(sender=sys.intern(sender)),
+    ),
+    (
+        ("Du hast das Gruppenbild gelöscht.\n",),
+        RoomAvatarDeleteBySelf,
+    ),
+    (
+        ("Du bist jetzt ein Admin.\n",),
+        RoomAdminPromotion,
+    ),
+    (
+        (
+            "Nachrichten, die du in diesem Chat sendest, sowie Anrufe, sind "
+            "jetzt mit Ende-zu-Ende-Verschlüsselung geschützt. Tippe für mehr "
+            "Infos.\n",
+        ),
+        RoomE2EEnabledNotification,
+    ),
+]
+
+
+class SystemEventMatcher:
+    def __init__(self, events=SYSTEM_EVENTS):
+        self._events: Dict[str, List[Tuple[re.Pattern, List[int], Callable]]]
+        self._events = collections.defaultdict(list)
+        for parts, make_message in events:
+            pattern, value_groups = _compile(parts)
+            self._events[_last_word(parts[-1])].append(
+                (pattern, value_groups, make_message)
+            )
+
+    def match(self, event: str, keep_full_text: bool = True) -> Optional[Message]:
+        """
+        match a system event (the text after the timestamp, including the
+        newline), or return None if it is none.
+        """
+        for pattern, value_groups, make_message in self._events.get(
+            _last_word(event), ()
+        ):
+            match = pattern.fullmatch(event)
+            if match is None:
+                continue
+
+            message = make_message(*(match.group(group) for group in value_groups))
+            if keep_full_text:
+                # the way arpeggio prints the node of the event
+                message.full_text = " | ".join(match.groups())
+            return message
+
+        return None
+
+
+def _last_word(text: str) -> str:
+    return text[text.rfind(" ") + 1 :]
+
+
+def _compile(parts: Tuple[str, ...]) -> Tuple[re.Pattern, List[int]]:
+    """
+    compile the parts of an event to a regular expression. Every part but
+    `_Not` is a group, and the groups of `_Until` parts are returned as well.
+    """
+    regex = ""
+    groups = 0
+    value_groups = []
+    for part in parts:
+        if isinstance(part, _Not):
+            regex += f"(?!{re.escape(part)})"
+            continue
+
+        groups += 1
+        if isinstance(part, _Until):
+            # at least one character, then stop at the first lookahead. the
+            # group cannot backtrack into a shorter or longer match.
+            lookahead = re.escape(part)
+            regex += f"(.(?:(?!{lookahead}).)*)(?={lookahead})"
+            value_groups.append(groups)
+        else:
+            regex += f"({re.escape(part)})"
+
+    return re.compile(regex), value_groups
@@ -2,12 +2,15 @@ from arpeggio import *
 from arpeggio.cleanpeg import ParserPEG
 from arpeggio import RegExMatch as _
 
+import functools
+import sys
 import types
 from datetime import datetime
 from typing import List
 from warnings import warn
 from zoneinfo import ZoneInfo
 
+from whatsapp_to_sqlite.parser.base import DEFAULT_TIMEZONE, MessageException
 from whatsapp_to_sqlite.messages import (
     Message,
     RoomAvatarChangeBySelf,
@@ -43,11 +46,6 @@ class MessageParser(ParserPython):
         super().__init__(*args, skipws=skipws, memoization=memoization, **kwargs)
 
 
-class MessageException(Exception):
-    def __init__(self, file_path):
-        self.file_path = file_path
-
-
 ###############################################################################
 # Grammar Definition
 ###############################################################################
@@ -373,31 +371,53 @@ def room_e2e_enabled_notification():
 ###############################################################################
 
 
+@functools.lru_cache(maxsize=4096)
+def make_timestamp(
+    day: str, month: str, year: str, hours: str, minutes: str, timezone: str
+) -> datetime:
+    """
+    build the timestamp of a message from its digits.
+
+    consecutive messages mostly share the same minute, so timestamps are
+    cached (datetimes are immutable and can be shared between messages).
+    """
+    # prepend century (thank god whatsapp did not exist before y2k
+    return datetime(
+        int("20" + year),
+        int(month),
+        int(day),
+        int(hours),
+        int(minutes),
+        tzinfo=ZoneInfo(timezone),
+    )
+
+
 class MessageVisitor(PTNodeVisitor):
+    def __init__(self, *args, keep_full_text=True, timezone=DEFAULT_TIMEZONE, **kwargs):
+        # the raw text of every message is rarely needed and doubles the
+        # memory held by parsed messages.
+        super().__init__(*args, **kwargs)
+        self.keep_full_text = keep_full_text
+        self.timezone = timezone
+
     def visit(self, parse_tree):
         return visit_parse_tree(parse_tree, self)
 
     def visit_timestamp(self, node, children):
-        # prepend century (thank god whatsapp did not exist before y2k
-        century = "20"
-        year = int(century + children[2])
-        month = int(children[1])
-        day = int(children[0])
-        hours = int(children[3])
-        minutes = int(children[4])
-        timezone = ZoneInfo("Europe/Berlin")
-        timestamp = datetime(year, month, day, hours, minutes, tzinfo=timezone)
-        return timestamp
+        day, month, year, hours, minutes = children
+        return make_timestamp(day, month, year, hours, minutes, self.timezone)
 
     def visit_username(self, node, children):
-        return str(node)
+        # the same few names repeat in every message, so they share one string
+        return sys.intern(str(node))
 
     # BEGIN system events
     def visit_system_event(self, node, children):
         full_text = str(node)
         if children and isinstance(children[0], Message):
             msg = children[0]
-            msg.full_text = full_text
+            if self.keep_full_text:
+                msg.full_text = full_text
             return msg
 
         warn(f"dropping unmatched message: {full_text}")
@@ -513,7 +533,7 @@ class MessageVisitor(PTNodeVisitor):
 
         msg = RoomMessage(
             timestamp=children[0],
-            full_text=str(node),
+            full_text=str(node) if self.keep_full_text else None,
             sender=children[1],
             text=msgdict.get("text"),
             continued_text=msgdict.get("continued_text"),
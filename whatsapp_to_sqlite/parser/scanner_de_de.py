@@ -0,0 +1,220 @@
+"""
+Line-oriented fast path for de_de chat logs.
+
+Plain user messages are recognised with precompiled regular expressions and
+turned into `RoomMessage` objects directly. System event lines are matched
+by the table in `events_de_de` instead of the arpeggio grammar in
+`parser_de_de`. Anything the scanner does not understand is parsed with the
+full grammar instead, so results (and parse errors) are identical to the
+grammar-only parser.
+
+`MessageScanner.iter_messages` splits a stream of lines into messages the same
+way the grammar does and yields them one at a time, so huge chat logs can be
+parsed without holding them in memory.
+"""
+
+import re
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, List
+
+from whatsapp_to_sqlite.messages import Message, RoomMessage
+from whatsapp_to_sqlite.parser.parser_de_de import (
+    DEFAULT_TIMEZONE,
+    MessageParser,
+    MessageVisitor,
+    log,
+    make_timestamp,
+)
+from whatsapp_to_sqlite.parser.events_de_de import SystemEventMatcher
+
+
+# a message starts at every line beginning with a timestamp, see
+# `continued_message` in the grammar.
+TIMESTAMP_LINE_RE = re.compile(r"^(\d\d)\.(\d\d)\.(\d\d), (\d\d):(\d\d)", re.MULTILINE)
+FILENAME_RE = re.compile(r"(.+\.\w+)", re.MULTILINE)
+
+TIMESTAMP_LENGTH = len("DD.MM.YY, HH:MM")
+SEPARATOR = " - "
+FILE_ATTACHED = " (Datei angehängt)\n"
+FILE_EXCLUDED = "<Medien ausgeschlossen>\n"
+
+
+class _FallbackToGrammar(Exception):
+    """raised when a chat log contains something the scanner cannot handle."""
+
+
+class MessageScanner:
+    def __init__(
+        self,
+        parser=MessageParser,
+        visitor=MessageVisitor,
+        keep_full_text=True,
+        timezone=DEFAULT_TIMEZONE,
+    ):
+        self.parser = parser
+        self.visitor = visitor
+        self.keep_full_text = keep_full_text
+        self.timezone = timezone
+        self._event_matcher = SystemEventMatcher()
+        self._log_parser = None
+        self._system_events = {}
+
+    def scan(self, string: str) -> List[Message]:
+        """Parse a whole chat log, which must end with a newline."""
+        try:
+            return list(self._scan(string))
+        except _FallbackToGrammar:
+            # the grammar decides what to make of it (most likely a NoMatch)
+            parse_tree = self.parser(log).parse(string)
+            return self._make_visitor().visit(parse_tree)
+
+    def iter_messages(
+        self, lines: Iterable[str], use_grammar: bool = False
+    ) -> Iterator[Message]:
+        """
+        Parse a chat log line by line, yielding messages as they are complete.
+
+        Only the lines of the current message are kept in memory. Messages the
+        scanner cannot handle (or all messages, if `use_grammar` is set) are
+        parsed with the grammar one at a time, so parse errors point to a
+        position in the offending message instead of the whole log.
+        """
+        chunk_lines = []
+        for line in lines:
+            if chunk_lines and TIMESTAMP_LINE_RE.match(line):
+                yield from self._scan_chunk("".join(chunk_lines), use_grammar)
+                chunk_lines = []
+            chunk_lines.append(line)
+
+        if not chunk_lines:
+            # an empty log does not match the grammar
+            chunk_lines.append("")
+        if not chunk_lines[-1].endswith("\n"):
+            chunk_lines[-1] += "\n"
+        yield from self._scan_chunk("".join(chunk_lines), use_grammar)
+
+    def _make_visitor(self) -> MessageVisitor:
+        return self.visitor(keep_full_text=self.keep_full_text, timezone=self.timezone)
+
+    def _scan_chunk(self, chunk: str, use_grammar: bool) -> List[Message]:
+        if not use_grammar and TIMESTAMP_LINE_RE.match(chunk):
+            try:
+                return [self._scan_message(chunk)]
+            except _FallbackToGrammar:
+                pass
+
+        if self._log_parser is None:
+            self._log_parser = self.parser(log)
+
+        parse_tree = self._log_parser.parse(chunk)
+        return self._make_visitor().visit(parse_tree)
+
+    def _scan(self, string: str) -> Iterator[Message]:
+        starts = [match.start() for match in TIMESTAMP_LINE_RE.finditer(string)]
+        if not starts or starts[0] != 0:
+            raise _FallbackToGrammar()
+
+        starts.append(len(string))
+        for start, end in zip(starts, starts[1:]):
+            yield self._scan_message(string[start:end])
+
+    def _scan_message(self, chunk: str) -> Message:
+        if chunk[TIMESTAMP_LENGTH : TIMESTAMP_LENGTH + 3] != SEPARATOR:
+            raise _FallbackToGrammar()
+
+        body_start = TIMESTAMP_LENGTH + 3
+        body_end = chunk.index("\n", body_start) + 1
+        body = chunk[body_start:body_end]
+
+        colon = body.find(":")
+        if colon == -1 or body[colon + 1] != " ":
+            if body_end != len(chunk):
+                # system events never span multiple lines
+                raise _FallbackToGrammar()
+            return self._parse_system_message(chunk, body)
+
+        if colon == 0:
+            # the grammar does not produce a usable message for empty senders
+            raise _FallbackToGrammar()
+
+        sender = sys.intern(body[:colon])
+        text = body[colon + 2 :]
+
+        fields = {}
+        file_match = FILENAME_RE.match(text)
+        if file_match and text[file_match.end() :] == FILE_ATTACHED:
+            fields["file"] = True
+            fields["filename"] = file_match.group().lstrip("\u200e")
+        elif text == FILE_EXCLUDED:
+            fields["file"] = True
+            fields["file_lost"] = True
+        else:
+            fields["text"] = text
+
+        continued_text = chunk[body_end:]
+        if continued_text:
+            fields["continued_text"] = continued_text
+
+        if self.keep_full_text:
+            fields["full_text"] = _make_full_text(
+                _split_timestamp(chunk), sender, text, continued_text
+            )
+
+        return RoomMessage(
+            timestamp=_make_timestamp(chunk, self.timezone),
+            sender=sender,
+            **fields,
+        )
+
+    def _parse_system_message(self, line: str, event: str) -> Message:
+        # system events repeat a lot (joins, e2e notices, ...), so each
+        # distinct event text is only parsed once and copied afterwards.
+        cached_message = self._system_events.get(event)
+        if cached_message is not None:
+            timestamp = _make_timestamp(line, self.timezone)
+            return cached_message.replace(timestamp=timestamp)
+
+        message = self._event_matcher.match(event, self.keep_full_text)
+        if message is None:
+            raise _FallbackToGrammar()
+
+        message.timestamp = _make_timestamp(line, self.timezone)
+        self._system_events[event] = message
+        return message.replace()
+
+
+def _split_timestamp(chunk: str) -> List[str]:
+    """split the timestamp prefix the same way the grammar tokenizes it."""
+    return [
+        chunk[0:2],
+        ".",
+        chunk[3:5],
+        ".",
+        chunk[6:8],
+        ", ",
+        chunk[10:12],
+        ":",
+        chunk[13:15],
+    ]
+
+
+def _make_full_text(
+    timestamp_parts: List[str], sender: str, text: str, continued_text: str
+) -> str:
+    """join the tokens of a user message the way arpeggio prints its node."""
+    parts = [*timestamp_parts, SEPARATOR, sender, ": "]
+    file_match = FILENAME_RE.match(text)
+    if file_match and text[file_match.end() :] == FILE_ATTACHED:
+        parts += [file_match.group(), FILE_ATTACHED]
+    else:
+        parts.append(text)
+    if continued_text:
+        parts += [line + "\n" for line in continued_text[:-1].split("\n")]
+    return " | ".join(parts)
+
+
+def _make_timestamp(chunk: str, timezone: str) -> datetime:
+    return make_timestamp(
+        chunk[0:2], chunk[3:5], chunk[6:8], chunk[10:12], chunk[13:15], timezone
+    )
@@ -1,31 +1,55 @@
+# pylint: disable=import-outside-toplevel
+# Pillow, sqlite_utils and arpeggio are imported where they are used, so the
+# command line starts (and --help returns) without loading them.
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Dict, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Dict,
+    Tuple,
+    Union,
+)
 from logging import Logger
 
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import fnmatch
+import functools
 import hashlib
 import io
 import itertools
+import logging
 import mimetypes
+import os
+import queue
+import re
 import time
 import shutil
+import sqlite3
+import threading
 import uuid
 
 import click
-from PIL import Image
-
-from sqlite_utils import Database
-from sqlite_utils.db import NotFoundError
 
 from whatsapp_to_sqlite.parser import (
+    DEFAULT_TIMEZONE,
     MessageException,
-    MessageVisitor,
-    NoMatch,
     get_chat_file_glob_by_locale,
     get_parser_by_locale,
     get_room_name_by_locale,
-    log,
+    get_scanner_by_locale,
 )
+from whatsapp_to_sqlite.metrics import Metrics
 from whatsapp_to_sqlite.messages import (
     Message,
     HasNewNumberMessage,
@@ -36,22 +60,229 @@ from whatsapp_to_sqlite.messages import (
     RoomMessage,
 )
 
+if TYPE_CHECKING:
+    from sqlite_utils import Database
+
 
 config_type_format: str = "com.github.skowalak.whatsapp-to-sqlite.{0}"
 config_url_format: str = "http://whatsapp-media.local/{0}"
 
+PARSER_MODES = ("grammar", "scanner")
+
+# ways to write messages: `Table.insert_all` of sqlite_utils, or prepared
+# statements with `executemany` on the connection, see `_insert_messages`
+WRITERS = ("sqlite-utils", "executemany")
+
+# columns of `message` rows made by `prepare_message_rows`
+MESSAGE_COLUMNS = (
+    "id",
+    "timestamp",
+    "sender_id",
+    "room_id",
+    "depth",
+    "type",
+    "message_content",
+    "file",
+    "file_id",
+    "target_user",
+    "new_room_name",
+    "new_number",
+)
 
-def make_db_backup(db_path: Path, logger: Logger) -> None:
+# number of messages (or media files) prepared and inserted at once
+INSERT_BATCH_SIZE = 1000
+
+# host parameters SQLite allows per statement before 3.32
+SQLITE_MAX_VARIABLES = 999
+
+# size of reads when hashing files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# ways to put media files into the output directory, see `move_files`
+COPY_STRATEGIES = ("copy", "reflink", "hardlink", "symlink")
+# FICLONE ioctl request on linux, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# connection settings for bulk loads, see `bulk_load`
+BULK_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -256 * 1024,  # KiB
+    "mmap_size": 1024 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+BULK_ROOMS_PER_TRANSACTION = 100
+
+# ways to back up the database before an import, see `make_db_backup`
+BACKUP_STRATEGIES = ("copy", "backup", "vacuum", "rollback", "none")
+# pages copied per step of an online backup
+BACKUP_PAGES = 16 * 1024
+
+# secondary indexes, created after loading data, see `create_indexes`
+INDEXES = [
+    ("message", ["room_id", "depth"]),
+    ("message", ["timestamp"]),
+    ("message", ["sender_id"]),
+    ("file_fs", ["name"]),
+    ("file_fs", ["sha512sum", "size"]),
+    ("file_chat", ["name"]),
+]
+
+# namespace of content-derived ids, see `content_id`. Changing it changes the
+# ids of every deterministically imported row.
+ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, config_type_format.format("id"))
+
+
+def make_db_backup(
+    db_path: Path,
+    logger: Logger,
+    strategy: str = "copy",
+    keep_backups: Optional[int] = None,
+    progress_callback=lambda *_: None,
+) -> Optional[Path]:
+    """
+    Back up the database file next to it with one of `BACKUP_STRATEGIES`.
+
+    "copy" copies the file, "backup" uses the SQLite online backup API and
+    calls `progress_callback(remaining, total)` with the number of pages,
+    "vacuum" writes a compacted copy with `VACUUM INTO`. "rollback" and "none"
+    do not write a backup file: with "rollback", callers run the import in
+    `single_transaction` instead. Only the `keep_backups` most recent backups
+    are kept, with any strategy. Returns the path of the backup.
+    """
+    if strategy not in BACKUP_STRATEGIES:
+        raise ValueError(f"unknown backup strategy: {strategy}")
+    if strategy in ("rollback", "none"):
+        if keep_backups is not None:
+            prune_db_backups(db_path, keep_backups, logger)
+        return None
+
+    backup_path = db_path.with_suffix(f".{time.time()}.bkp{db_path.suffix}")
+    logger.debug("back up database to %s (%s)", backup_path, strategy)
     try:
-        shutil.copy2(
-            db_path, db_path.with_suffix(f".{time.time()}.bkp{db_path.suffix}")
-        )
-    except OSError as error:
+        if strategy == "copy":
+            shutil.copy2(db_path, backup_path)
+        elif strategy == "backup":
+            source = sqlite3.connect(db_path)
+            target = sqlite3.connect(backup_path)
+            with contextlib.closing(source), contextlib.closing(target):
+                source.backup(
+                    target,
+                    pages=BACKUP_PAGES,
+                    progress=lambda _, remaining, total: progress_callback(
+                        remaining, total
+                    ),
+                )
+        elif strategy == "vacuum":
+            with contextlib.closing(sqlite3.connect(db_path)) as source:
+                source.execute("VACUUM INTO ?", [str(backup_path)])
+    except (OSError, sqlite3.Error) as error:
         logger.error("Cannot write backup database file: %s", str(error))
         raise click.ClickException(
             "Database file already exists, cannot write backup file."
         )
 
+    if keep_backups is not None:
+        prune_db_backups(db_path, keep_backups, logger)
+
+    return backup_path
+
+
+def prune_db_backups(db_path: Path, keep_backups: int, logger: Logger) -> None:
+    """delete all but the `keep_backups` most recent backups of a database."""
+    suffix = f".bkp{db_path.suffix}"
+    backups = []
+    for backup_path in db_path.parent.glob(f"{db_path.stem}.*{suffix}"):
+        # copies keep the modification time of the database, so backups are
+        # ordered by the time in their name instead
+        backup_time = backup_path.name[len(db_path.stem) + 1 : -len(suffix)]
+        try:
+            backups.append((float(backup_time), backup_path))
+        except ValueError:
+            continue
+
+    for _, backup_path in sorted(backups, reverse=True)[keep_backups:]:
+        logger.debug("delete old backup %s", backup_path)
+        backup_path.unlink()
+
+
+class _BulkConnection:
+    """
+    Connection proxy that keeps one transaction open across many writes.
+
+    sqlite_utils wraps every write in `with conn:`, which commits right away.
+    The proxy turns these blocks into no-ops, so a transaction lasts until
+    `commit` is called explicitly.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def commit(self):
+        self._conn.commit()
+        # deferring foreign keys only lasts for one transaction
+        self._conn.execute("PRAGMA defer_foreign_keys = ON")
+
+
+@contextlib.contextmanager
+def bulk_load(db: Database, logger: Logger) -> Iterator[Database]:
+    """
+    Tune the connection of `db` for bulk inserts.
+
+    Yields a database on the same connection whose writes are only committed
+    by explicit `db.conn.commit()` calls (or when the block ends), with foreign
+    key checks deferred to commit time. Afterwards the WAL is checkpointed and
+    the previous connection settings are restored. On errors, uncommitted
+    writes are rolled back.
+    """
+    previous_pragmas = {
+        pragma: db.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in BULK_PRAGMAS
+    }
+    logger.debug("bulk load, previous settings: %s", previous_pragmas)
+    for pragma, value in BULK_PRAGMAS.items():
+        db.execute(f"PRAGMA {pragma} = {value}")
+    db.execute("PRAGMA defer_foreign_keys = ON")
+
+    from sqlite_utils import Database
+
+    try:
+        yield Database(_BulkConnection(db.conn))
+        db.conn.commit()
+    except BaseException:
+        db.conn.rollback()
+        raise
+    finally:
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        for pragma, value in previous_pragmas.items():
+            db.execute(f"PRAGMA {pragma} = {value}")
+
+
+@contextlib.contextmanager
+def single_transaction(db: Database) -> Iterator[Database]:
+    """
+    Yield a database on the connection of `db` whose writes are all committed
+    when the block ends, or rolled back if it raises (or is interrupted).
+    Errors that are handled inside the block do not roll anything back, the
+    block has to raise for that.
+    """
+    from sqlite_utils import Database
+
+    try:
+        yield Database(_BulkConnection(db.conn))
+        db.conn.commit()
+    except BaseException:
+        db.conn.rollback()
+        raise
+
 
 def init_db(db: Database, logger: Logger) -> None:
     if db.schema == "":
@@ -155,25 +386,383 @@ def init_db(db: Database, logger: Logger) -> None:
         # raise click.ClickException("Incorrect database schema version.")
         logger.debug("database already initialized: %s", db.schema)
 
+    # sender names are looked up by name, see `SenderRegistry`
+    try:
+        db["sender"].create_index(["name"], unique=True, if_not_exists=True)
+    except sqlite3.IntegrityError:
+        logger.warning("sender names are not unique, cannot create unique index")
+
+    # keeps track of imported chat files for incremental imports. created
+    # separately, so databases from older versions get it as well.
+    db["room_import"].create(
+        {
+            "room_id": str,
+            "file_name": str,
+            "size": int,
+            "sha512sum": str,
+            "last_message_id": str,
+            "depth": int,
+        },
+        pk="room_id",
+        foreign_keys=[
+            ("room_id", "room", "id"),
+            ("last_message_id", "message", "id"),
+        ],
+        if_not_exists=True,
+    )
+
+    # digests of media files from earlier imports, see `import_media_to_db`
+    db["file_fs_cache"].create(
+        {
+            "path": str,
+            "size": int,
+            "mtime_ns": int,
+            "inode": int,
+            "sha512sum": str,
+            "mime_type": str,
+            "preview": bytes,
+            "preview_attempted": bool,
+        },
+        pk="path",
+        if_not_exists=True,
+    )
+
+    # whether a preview was generated (or could not be), so files without one
+    # are not decoded again, see `generate_previews`
+    for table in ("file_fs", "file_fs_cache"):
+        if "preview_attempted" not in db[table].columns_dict:
+            db[table].add_column("preview_attempted", bool)
+
+    # objects already in an output directory, see `move_files`
+    db["file_store"].create(
+        {"directory": str, "sha512sum": str},
+        pk=("directory", "sha512sum"),
+        if_not_exists=True,
+    )
+
+
+def create_indexes(db: Database, logger: Logger) -> None:
+    """
+    create the secondary indexes in `INDEXES` that do not exist yet.
+
+    Maintaining indexes slows down inserts, so imports call this after loading
+    their data instead of `init_db` creating them up front.
+    """
+    for table, columns in INDEXES:
+        if not db[table].exists():
+            continue
+        logger.debug("create index on %s(%s)", table, ", ".join(columns))
+        db[table].create_index(columns, if_not_exists=True)
+
+
+def optimize_db(db: Database, logger: Logger, vacuum: bool = False) -> None:
+    """create missing indexes, update query planner statistics and vacuum."""
+    create_indexes(db, logger)
+    logger.debug("analyze database")
+    db.execute("ANALYZE")
+    db.execute("PRAGMA optimize")
+    if vacuum:
+        logger.debug("vacuum database")
+        db.vacuum()
+
+
+def parse_string(
+    string: str,
+    locale: str,
+    logger,
+    mode: str = "grammar",
+    keep_full_text: bool = True,
+    timezone: str = DEFAULT_TIMEZONE,
+) -> List[Message]:
+    """
+    Parse a single string using arpeggio grammar definition.
 
-def parse_string(string: str, locale: str, logger) -> List[Message]:
-    """Parse a single string using arpeggio grammar definition."""
+    In "scanner" mode, messages are recognised by a line-oriented fast path
+    and only what it does not understand is parsed by the grammar. Both modes
+    return identical results. Without `keep_full_text`, the raw text of
+    messages is not kept in `full_text`, which is never saved to the database.
+    Timestamps are interpreted in `timezone`.
+    """
     if not string.endswith("\n"):
         logger.debug("file not ending with EOL found, adding newline")
         string = string + "\n"
 
+    if mode == "scanner":
+        localized_scanner = get_scanner_by_locale(locale)
+        scanner = localized_scanner(keep_full_text=keep_full_text, timezone=timezone)
+        return scanner.scan(string)
+
+    from whatsapp_to_sqlite.parser.parser_de_de import MessageVisitor, log
+
     localized_parser = get_parser_by_locale(locale)
     parse_tree = localized_parser(log).parse(string)
-    return MessageVisitor().visit(parse_tree)
+    visitor = MessageVisitor(keep_full_text=keep_full_text, timezone=timezone)
+    return visitor.visit(parse_tree)
 
 
-def parse_room_file(file_path: Path, locale: str, logger: Logger) -> List[Message]:
-    with file_path.open("r", encoding="utf-8") as room_file:
-        string = room_file.read()
+def parse_room_file(
+    file_path: Path,
+    locale: str,
+    logger: Logger,
+    mode: str = "grammar",
+    offset: int = 0,
+    keep_full_text: bool = True,
+    timezone: str = DEFAULT_TIMEZONE,
+) -> List[Message]:
+    """Parse a chat file, skipping the first `offset` bytes if given."""
+    from whatsapp_to_sqlite.parser.parser_de_de import NoMatch
+
+    with file_path.open("rb") as binary_file:
+        binary_file.seek(offset)
+        with io.TextIOWrapper(binary_file, encoding="utf-8") as room_file:
+            string = room_file.read()
+
+        if offset and string.startswith("\n"):
+            # the previous export did not end with EOL
+            string = string[1:]
+
+        if offset and (not string or string.isspace()):
+            return []
+
         try:
-            return parse_string(string, locale, logger)
+            return parse_string(string, locale, logger, mode, keep_full_text, timezone)
         except NoMatch as exception:
-            raise MessageException(file_path) from exception
+            raise MessageException(file_path, str(exception)) from exception
+
+
+def iter_room_file(
+    file_path: Path,
+    locale: str,
+    logger: Logger,
+    mode: str = "grammar",
+    offset: int = 0,
+    keep_full_text: bool = True,
+    timezone: str = DEFAULT_TIMEZONE,
+) -> Iterator[Message]:
+    """
+    Parse a chat file message by message, without reading all of it at once.
+
+    Memory use is bounded by the longest message instead of the file size.
+    Parse errors are raised while iterating.
+    """
+    from whatsapp_to_sqlite.parser.parser_de_de import NoMatch
+
+    logger.debug("streaming %s from byte %s", file_path, offset)
+    localized_scanner = get_scanner_by_locale(locale)(
+        keep_full_text=keep_full_text, timezone=timezone
+    )
+    with file_path.open("rb") as binary_file:
+        binary_file.seek(offset)
+        with io.TextIOWrapper(binary_file, encoding="utf-8") as room_file:
+            lines = iter(room_file)
+            if offset:
+                first_line = next(lines, None)
+                if first_line is None:
+                    return
+                if first_line != "\n":
+                    # otherwise the previous export did not end with EOL
+                    lines = itertools.chain([first_line], lines)
+
+            try:
+                yield from localized_scanner.iter_messages(
+                    lines, use_grammar=(mode != "scanner")
+                )
+            except NoMatch as exception:
+                raise MessageException(file_path, str(exception)) from exception
+
+
+def parse_room_files(
+    files: List[Path],
+    locale: str,
+    logger: Logger,
+    mode: str = "grammar",
+    jobs: int = 1,
+    offsets: Optional[Dict[Path, int]] = None,
+    stream: bool = False,
+    keep_full_text: bool = True,
+    timezone: str = DEFAULT_TIMEZONE,
+) -> Iterator[Tuple[Path, Callable[[], Iterable[Message]]]]:
+    """
+    Parse chat files, optionally in a pool of `jobs` worker processes.
+
+    Files are yielded in their original order together with a callable that
+    returns the parsed room (or raises the parsing exception), so the caller
+    can write rooms one after another regardless of worker scheduling. At most
+    two files per worker are parsed ahead of the caller. Files listed in
+    `offsets` are only parsed from that byte offset on.
+
+    With `stream`, the callable returns a message iterator (see
+    `iter_room_file`) instead of a list. Streaming requires a single job.
+    """
+    offsets = offsets or {}
+    if stream and jobs > 1:
+        raise ValueError("streamed rooms cannot be parsed in worker processes")
+
+    if jobs <= 1:
+        parse = iter_room_file if stream else parse_room_file
+        for file in files:
+            offset = offsets.get(file, 0)
+            yield file, functools.partial(
+                parse, file, locale, logger, mode, offset, keep_full_text, timezone
+            )
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        files_iter = iter(files)
+        pending = collections.deque()
+
+        def submit(file: Path):
+            offset = offsets.get(file, 0)
+            future = executor.submit(
+                parse_room_file,
+                file,
+                locale,
+                logger,
+                mode,
+                offset,
+                keep_full_text,
+                timezone,
+            )
+            pending.append((file, future))
+
+        for file in itertools.islice(files_iter, 2 * jobs):
+            submit(file)
+
+        while pending:
+            file, future = pending.popleft()
+            next_file = next(files_iter, None)
+            if next_file is not None:
+                submit(next_file)
+
+            yield file, future.result
+
+
+class PipelineStats:
+    """
+    Utilisation of the parse and insert stages of `pipeline_room_files`.
+
+    `blocked_seconds` is the time the parser waited for a free slot in the
+    queue (back-pressure from inserting), `wait_seconds` the time inserting
+    waited for the next parsed room.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.queued = 0
+        self.parse_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._start = time.perf_counter()
+
+    def utilisation(self) -> Tuple[float, float]:
+        """fraction of the time the parse and insert stages were busy."""
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        return (
+            min(self.parse_seconds / elapsed, 1.0),
+            max(1.0 - self.wait_seconds / elapsed, 0.0),
+        )
+
+    def describe(self) -> str:
+        parse, insert = self.utilisation()
+        return (
+            f"queue {self.queued}/{self.queue_size}, parse {parse:.0%}, "
+            f"insert {insert:.0%}, parser blocked {self.blocked_seconds:.1f}s"
+        )
+
+
+def pipeline_room_files(
+    parsed_files: Iterable[Tuple[Path, Callable[[], Iterable[Message]]]],
+    queue_size: int,
+    offsets: Optional[Dict[Path, int]] = None,
+    metrics: Optional[Metrics] = None,
+    stats: Optional[PipelineStats] = None,
+) -> Iterator[Tuple[Path, Callable[[], Iterable[Message]]]]:
+    """
+    Parse the rooms of `parse_room_files` in a background thread while the
+    caller inserts the previous ones.
+
+    Files are yielded in order like `parse_room_files` does, but their
+    callables return the room parsed ahead of time (or raise its parsing
+    exception). At most `queue_size` parsed rooms wait for the caller, so the
+    parser blocks when inserting falls behind. Streamed rooms cannot be
+    parsed ahead.
+    """
+    offsets = offsets or {}
+    metrics = metrics or Metrics()
+    stats = stats or PipelineStats(queue_size)
+    rooms = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+    failures = []
+
+    def put(item) -> None:
+        put_start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                rooms.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        blocked_seconds = time.perf_counter() - put_start
+        stats.blocked_seconds += blocked_seconds
+        metrics.add("parse-blocked", wall_seconds=blocked_seconds)
+        stats.queued = rooms.qsize()
+
+    def produce() -> None:
+        try:
+            for file, parse_room in parsed_files:
+                if stop.is_set():
+                    break
+                metrics.set_file(file)
+                parse_start = time.perf_counter()
+                with metrics.measure("parse") as counts:
+                    try:
+                        room = parse_room()
+                    except Exception as error:  # pylint: disable=broad-except
+                        result = functools.partial(_reraise, error)
+                    else:
+                        result = functools.partial(_identity, room)
+                        if isinstance(room, list):
+                            counts["items"] = len(room)
+                            size = file.stat().st_size
+                            counts["bytes"] = size - offsets.get(file, 0)
+                stats.parse_seconds += time.perf_counter() - parse_start
+                metrics.set_file(None)
+                put((file, result))
+        except Exception as error:  # pylint: disable=broad-except
+            # e.g. a broken worker pool, raised in the caller's thread below
+            failures.append(error)
+        finally:
+            put(done)
+
+    producer = threading.Thread(target=produce, name="room-parser", daemon=True)
+    producer.start()
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            item = rooms.get()
+            wait_seconds = time.perf_counter() - wait_start
+            stats.wait_seconds += wait_seconds
+            metrics.add("parse-wait", wall_seconds=wait_seconds)
+            stats.queued = rooms.qsize()
+            if item is done:
+                break
+            yield item
+
+        if failures:
+            raise failures[0]
+    finally:
+        # unblock the parser if the caller stopped early
+        stop.set()
+        producer.join()
+
+
+def _identity(value):
+    return value
+
+
+def _reraise(error: Exception):
+    raise error
 
 
 def get_room_name(absolute_file_path: str, locale) -> str:
@@ -183,23 +772,44 @@ def get_room_name(absolute_file_path: str, locale) -> str:
 
 
 def save_room(
-    room: List[Message],
+    room: Iterable[Message],
     room_name: str,
     system_message_id: uuid.UUID,
     db: Database,
     progress_callback=lambda *_: None,
-):
-    """Insert a room (list of messages in one room context) into the database."""
-    if not room:
-        return
+    sender_registry: Optional["SenderRegistry"] = None,
+    deterministic_ids: bool = False,
+    metrics: Optional[Metrics] = None,
+    writer: str = "sqlite-utils",
+) -> Optional[Dict]:
+    """
+    Insert a room (list of messages in one room context) into the database.
+
+    `room` may be any iterable of messages, e.g. from `iter_room_file`.
+    Messages are inserted in batches. Pass a `SenderRegistry` when importing
+    several rooms, otherwise senders are loaded from the database. Returns the
+    import state of the room, see `record_room_import`.
+
+    With `deterministic_ids`, ids are derived from the room name and message
+    contents (see `content_id`) and rows that exist already are left alone, so
+    importing the same chat file again does not duplicate it. `writer` is one
+    of `WRITERS`.
+    """
+    room_iter = iter(room or ())
+    first_message = next(room_iter, None)
+    if first_message is None:
+        return None
+    room = itertools.chain([first_message], room_iter)
 
     # create room
     room_id = uuid.uuid4()
+    if deterministic_ids:
+        room_id = content_id("room", room_name, *_message_content(first_message))
 
     # check if first message in room matches a group or a DM
     room_is_dm = True
     if isinstance(
-        room[0],
+        first_message,
         (
             RoomCreateBySelf,
             RoomCreateByThirdParty,
@@ -207,56 +817,375 @@ def save_room(
     ):
         room_is_dm = False
 
-    sender_lookup_table = get_sender_lookup_table(db)
-
-    messages, files = prepare_messages(
+    first_message_id, last_message_id, depth = _insert_messages(
         room,
         room_id,
         system_message_id,
-        sender_lookup_table,
+        db,
+        progress_callback=progress_callback,
+        sender_registry=sender_registry,
+        deterministic_ids=deterministic_ids,
+        metrics=metrics,
+        writer=writer,
     )
-    first_message_id = messages[0]["id"]
-    message_ids = [message["id"] for message in messages]
-    message_relationships = [
-        {"message_id": str(y), "parent_message_id": str(x)}
-        for x, y in itertools.pairwise(message_ids)
-    ]
-    senders = list(sender_lookup_table.values())
+
+    room_row = {
+        "id": str(room_id),
+        "is_dm": room_is_dm,
+        "first_message": str(first_message_id),
+        "display_img": None,
+        "name": room_name,
+        "member_count": 0,
+    }
+    if writer == "executemany":
+        with db.conn:
+            _executemany(
+                db,
+                "room",
+                tuple(room_row),
+                [tuple(room_row.values())],
+                ignore=deterministic_ids,
+            )
+    else:
+        db["room"].insert(room_row, ignore=deterministic_ids)
 
     progress_callback()
+    return {
+        "room_id": str(room_id),
+        "last_message_id": str(last_message_id),
+        "depth": depth,
+    }
 
-    db["file_chat"].insert_all(files)
-    db["sender"].insert_all(senders, ignore=True)
-    db["message"].insert_all(messages)
-    db["message_x_message"].insert_all(message_relationships)
 
-    db["room"].insert(
-        {
-            "id": str(room_id),
-            "is_dm": room_is_dm,
-            "first_message": str(first_message_id),
-            "display_img": None,
-            "name": room_name,
-            "member_count": 0,
-        }
+def append_to_room(
+    room: Iterable[Message],
+    previous_import: Dict,
+    system_message_id: uuid.UUID,
+    db: Database,
+    progress_callback=lambda *_: None,
+    sender_registry: Optional["SenderRegistry"] = None,
+    deterministic_ids: bool = False,
+    metrics: Optional[Metrics] = None,
+    writer: str = "sqlite-utils",
+) -> Dict:
+    """
+    Append messages to a previously imported room.
+
+    `depth` and the `message_x_message` chain continue where the previous
+    import stopped. Returns the new import state of the room.
+    """
+    state = {
+        "room_id": previous_import["room_id"],
+        "last_message_id": previous_import["last_message_id"],
+        "depth": previous_import["depth"],
+    }
+    room_iter = iter(room or ())
+    first_message = next(room_iter, None)
+    if first_message is None:
+        return state
+    room = itertools.chain([first_message], room_iter)
+
+    _, last_message_id, depth = _insert_messages(
+        room,
+        uuid.UUID(state["room_id"]),
+        system_message_id,
+        db,
+        start_depth=state["depth"] + 1,
+        parent_message_id=state["last_message_id"],
+        progress_callback=progress_callback,
+        sender_registry=sender_registry,
+        deterministic_ids=deterministic_ids,
+        metrics=metrics,
+        writer=writer,
     )
 
     progress_callback()
+    state.update({"last_message_id": str(last_message_id), "depth": depth})
+    return state
+
+
+def _insert_messages(
+    room: Iterable[Message],
+    room_id: uuid.UUID,
+    system_message_id: uuid.UUID,
+    db: Database,
+    start_depth: int = 1,
+    parent_message_id: Optional[str] = None,
+    progress_callback=lambda *_: None,
+    sender_registry: Optional["SenderRegistry"] = None,
+    deterministic_ids: bool = False,
+    metrics: Optional[Metrics] = None,
+    writer: str = "sqlite-utils",
+) -> Tuple[str, str, int]:
+    """
+    Insert messages of a room in batches, returns first and last message id
+    and depth.
+
+    If the messages cannot be read to the end (e.g. a parse error while
+    streaming), the messages inserted so far are removed again. Rows with
+    deterministic ids are kept instead: they may have existed before, and
+    importing the room again completes them.
+
+    Preparing and inserting batches is measured in `metrics`. Streamed rooms
+    are parsed while their batches are prepared.
+
+    The "executemany" writer inserts tuples from `prepare_message_rows` with
+    prepared statements, committing once per batch, instead of handing dicts
+    to sqlite_utils, which inspects their keys and builds its SQL per chunk.
+    """
+    if sender_registry is None:
+        sender_registry = SenderRegistry(db, deterministic_ids)
+    metrics = metrics or Metrics()
+
+    first_message_id = None
+    last_message_id = parent_message_id
+    depth = start_depth - 1
+    progress_callback()
+
+    try:
+        batches = _batched(room, INSERT_BATCH_SIZE)
+        while True:
+            with metrics.measure("prepare") as counts:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                rows, files = prepare_message_rows(
+                    batch,
+                    room_id,
+                    system_message_id,
+                    sender_registry,
+                    start_depth=depth + 1,
+                    deterministic_ids=deterministic_ids,
+                )
+                message_ids = [row[0] for row in rows]
+                if last_message_id:
+                    message_ids.insert(0, last_message_id)
+                message_relationships = list(zip(message_ids[1:], message_ids))
+                counts["items"] = len(rows)
+
+            with metrics.measure("insert", items=len(rows)):
+                sender_registry.insert_new_senders(writer)
+                if writer == "executemany":
+                    _insert_rows(
+                        db, files, rows, message_relationships, deterministic_ids
+                    )
+                else:
+                    db["file_chat"].insert_all(
+                        ({"id": file_id, "name": name} for file_id, name in files),
+                        ignore=deterministic_ids,
+                    )
+                    db["message"].insert_all(
+                        (dict(zip(MESSAGE_COLUMNS, row)) for row in rows),
+                        ignore=deterministic_ids,
+                    )
+                    db["message_x_message"].insert_all(
+                        (
+                            {"message_id": message_id, "parent_message_id": parent_id}
+                            for message_id, parent_id in message_relationships
+                        ),
+                        ignore=deterministic_ids,
+                    )
+
+            first_message_id = first_message_id or rows[0][0]
+            last_message_id = rows[-1][0]
+            depth = rows[-1][4]
+    except Exception:
+        if not deterministic_ids:
+            _delete_room_messages(db, room_id, after_depth=start_depth - 1)
+        raise
+
+    return first_message_id, last_message_id, depth
+
+
+def _insert_rows(
+    db: Database,
+    files: List[Tuple],
+    messages: List[Tuple],
+    message_relationships: List[Tuple],
+    ignore: bool = False,
+) -> None:
+    """insert rows of `prepare_message_rows` in one transaction."""
+    with db.conn:
+        _executemany(db, "file_chat", ("id", "name"), files, ignore)
+        _executemany(db, "message", MESSAGE_COLUMNS, messages, ignore)
+        _executemany(
+            db,
+            "message_x_message",
+            ("message_id", "parent_message_id"),
+            message_relationships,
+            ignore,
+        )
+
+
+def _executemany(
+    db: Database,
+    table: str,
+    columns: Tuple[str, ...],
+    rows: List[Tuple],
+    ignore: bool = False,
+) -> None:
+    if rows:
+        db.conn.executemany(_get_insert_sql(table, columns, ignore), rows)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_insert_sql(table: str, columns: Tuple[str, ...], ignore: bool) -> str:
+    return "INSERT{} INTO [{}] ({}) VALUES ({})".format(
+        " OR IGNORE" if ignore else "",
+        table,
+        ", ".join(f"[{column}]" for column in columns),
+        ", ".join("?" for _ in columns),
+    )
+
+
+def _delete_room_messages(db: Database, room_id: uuid.UUID, after_depth: int = 0):
+    """delete messages (and their files and relationships) of a room."""
+    where = "room_id = ? AND depth > ?"
+    where_args = [str(room_id), after_depth]
+    with db.conn:
+        db.execute(
+            "DELETE FROM message_x_message WHERE message_id IN "
+            f"(SELECT id FROM message WHERE {where})",
+            where_args,
+        )
+        db.execute(
+            "DELETE FROM file_chat WHERE id IN "
+            f"(SELECT file_id FROM message WHERE {where})",
+            where_args,
+        )
+        db.execute(f"DELETE FROM message WHERE {where}", where_args)
+
+
+def get_previous_imports(
+    files: List[Path],
+    locale: str,
+    db: Database,
+    digests: Optional[Dict[Path, Tuple[int, str]]] = None,
+) -> Dict[Path, Dict]:
+    """
+    Find chat files continuing a chat file that was imported before.
+
+    WhatsApp exports are cumulative, so a chat file is a continuation of an
+    earlier import of a room with the same name if its first `size` bytes have
+    the digest recorded for that import. If several imports match, the most
+    recent (largest) one is used.
+
+    If `digests` is given, size and digest of every file that has to be read
+    anyway are added to it, in the same pass, for `record_room_import`.
+    """
+    previous_imports = {}
+    for file in files:
+        try:
+            room_name = get_room_name(file, locale)
+        except (AttributeError, NotImplementedError):
+            continue
+
+        file_size = file.stat().st_size
+        candidates = [
+            row
+            for row in db.query(
+                "SELECT room_import.* FROM room_import "
+                "JOIN room ON room.id = room_import.room_id "
+                "WHERE room.name = ? AND room_import.size <= ?",
+                [room_name, file_size],
+            )
+        ]
+        if not candidates:
+            continue
+
+        offsets = [row["size"] for row in candidates]
+        if digests is not None:
+            offsets.append(file_size)
+        prefix_hashes = _get_prefix_hashes(file, offsets)
+        if file_size in prefix_hashes and digests is not None:
+            digests[file] = (file_size, prefix_hashes[file_size])
+        matches = [
+            row
+            for row in candidates
+            if prefix_hashes.get(row["size"]) == row["sha512sum"]
+        ]
+        if matches:
+            previous_imports[file] = max(matches, key=lambda row: row["size"])
+
+    return previous_imports
+
+
+def record_room_import(
+    db: Database,
+    file_path: Path,
+    state: Dict,
+    digest: Optional[Tuple[int, str]] = None,
+) -> None:
+    """
+    remember size and digest of an imported chat file for its room.
+
+    `digest` is the size and digest of the file from `get_previous_imports`,
+    which is only hashed again if its size changed since.
+    """
+    file_size = file_path.stat().st_size
+    if digest is None or digest[0] != file_size:
+        digest = (file_size, _get_prefix_hashes(file_path, [file_size])[file_size])
+    db["room_import"].upsert(
+        {
+            **state,
+            "file_name": file_path.name,
+            "size": file_size,
+            "sha512sum": digest[1],
+        },
+        pk="room_id",
+    )
 
 
 def prepare_messages(
-    messages: List[Message],
+    messages: Iterable[Message],
     room_id: uuid.UUID,
     system_message_id: uuid.UUID,
-    sender_lookup_table: Dict,
+    sender_registry: "SenderRegistry",
     progress_callback=lambda *_: None,
+    start_depth: int = 1,
+    deterministic_ids: bool = False,
 ) -> Tuple[List[Dict], List[Dict]]:
+    """prepare `message` and `file_chat` rows as dicts for sqlite_utils."""
+    rows, files = prepare_message_rows(
+        messages,
+        room_id,
+        system_message_id,
+        sender_registry,
+        progress_callback,
+        start_depth,
+        deterministic_ids,
+    )
+    return (
+        [dict(zip(MESSAGE_COLUMNS, row)) for row in rows],
+        [{"id": file_id, "name": name} for file_id, name in files],
+    )
+
+
+def prepare_message_rows(
+    messages: Iterable[Message],
+    room_id: uuid.UUID,
+    system_message_id: uuid.UUID,
+    sender_registry: "SenderRegistry",
+    progress_callback=lambda *_: None,
+    start_depth: int = 1,
+    deterministic_ids: bool = False,
+) -> Tuple[List[Tuple], List[Tuple]]:
+    """
+    prepare `message` rows as tuples in the order of `MESSAGE_COLUMNS` and
+    `file_chat` rows as (id, name) tuples, with values as sqlite_utils would
+    store them.
+    """
     prepared_messages = []
     prepared_files = []
-    for depth, message in enumerate(messages, start=1):
-        sender_id = get_sender(message, system_message_id, sender_lookup_table)
+    room_id_str = str(room_id)
+    for depth, message in enumerate(messages, start=start_depth):
+        sender_id = get_sender(message, system_message_id, sender_registry)
 
         message_id = uuid.uuid4()
+        if deterministic_ids:
+            message_id = content_id(
+                "message", room_id, depth, *_message_content(message)
+            )
         file_id = None
         message_file = False
         message_text = None
@@ -271,15 +1200,18 @@ def prepare_messages(
             elif not message_text and message.continued_text:
                 message_text = message.continued_text
 
-            msg_file = get_file(message)
+            msg_file = get_file(
+                message,
+                content_id("file", message_id) if deterministic_ids else None,
+            )
             if msg_file:
                 message_file = True
-                file_id = msg_file["id"]
-                prepared_files.append(msg_file)
+                file_id = str(msg_file["id"])
+                prepared_files.append((file_id, msg_file["name"]))
 
         if isinstance(message, HasTargetUserMessage):
             # FIXME(skowalak): This does not handle multiple target users -> data model change
-            message_target_user = get_participant(message.target, sender_lookup_table)
+            message_target_user = get_participant(message.target, sender_registry)
 
         if isinstance(message, HasNewRoomNameMessage):
             message_new_room_name = message.new_room_name
@@ -288,35 +1220,40 @@ def prepare_messages(
             message_new_number = message.new_number
 
         prepared_messages.append(
-            {
-                "id": str(message_id),
-                "timestamp": message.timestamp,
-                "sender_id": str(sender_id),
-                "room_id": str(room_id),
-                "depth": depth,
-                "type": config_type_format.format(message.__class__.__name__),
-                "message_content": message_text,
-                "file": message_file,
-                "file_id": str(file_id) if file_id else None,
-                "target_user": str(message_target_user)
-                if message_target_user
-                else None,
-                "new_room_name": message_new_room_name,
-                "new_number": message_new_number,
-            }
+            (
+                str(message_id),
+                message.timestamp.isoformat() if message.timestamp else None,
+                str(sender_id),
+                room_id_str,
+                depth,
+                _message_type(message.__class__),
+                message_text,
+                message_file,
+                file_id,
+                str(message_target_user) if message_target_user else None,
+                message_new_room_name,
+                message_new_number,
+            )
         )
         progress_callback()
 
     return prepared_messages, prepared_files
 
 
+@functools.lru_cache(maxsize=None)
+def _message_type(message_class: type) -> str:
+    return config_type_format.format(message_class.__name__)
+
+
 def get_sender(
-    message: Message, system_message_id: uuid.UUID, look_up_table: Dict
+    message: Message,
+    system_message_id: uuid.UUID,
+    sender_registry: "SenderRegistry",
 ) -> uuid.UUID:
     """get the sender record of a message, if it has one"""
     if hasattr(message, "sender"):
         try:
-            return get_participant(message.sender, look_up_table)
+            return get_participant(message.sender, sender_registry)
         except ValueError:
             # probably a "BySelf" message
             return system_message_id
@@ -324,45 +1261,97 @@ def get_sender(
     return system_message_id
 
 
-def get_participant(name: str, look_up_table: Dict) -> uuid.UUID:
-    """use the lookuptable to check if an id for this name already exists"""
+def get_participant(name: str, sender_registry: "SenderRegistry") -> uuid.UUID:
+    """use the sender registry to check if an id for this name already exists"""
     if not name:
         raise ValueError("invalid name")
 
     # TODO(skowalak): If it ever happens: relevant for arabic locales?
     name = name.lstrip("\u200e")
 
-    sender_id = look_up_table.get(name, {}).get("id")
-    if not sender_id:
-        sender_id = uuid.uuid4()
-        look_up_table[name] = {"id": sender_id, "name": name}
-
-    return sender_id
+    return sender_registry.get_id(name)
 
 
-def get_file(message: Message) -> Optional[Dict]:
+def get_file(message: Message, file_id: Optional[uuid.UUID] = None) -> Optional[Dict]:
     """get a file from a message, if one exists."""
     if message.file:
         if not message.filename and not message.file_lost:
             raise ValueError("message indicates file, but no filename")
-        return {"id": uuid.uuid4(), "name": message.filename}
+        return {"id": file_id or uuid.uuid4(), "name": message.filename}
+
+
+def content_id(*parts) -> uuid.UUID:
+    """derive a stable id from `parts`, used with `deterministic_ids`."""
+    return uuid.uuid5(ID_NAMESPACE, "\x1f".join(str(part) for part in parts))
+
+
+def _message_content(message: Message) -> Tuple:
+    """the fields identifying a message, regardless of how it was parsed."""
+    return (
+        message.__class__.__name__,
+        message.timestamp.isoformat() if message.timestamp else None,
+        *(
+            getattr(message, field, None)
+            for field in (
+                "sender",
+                "text",
+                "continued_text",
+                "filename",
+                "target",
+                "new_room_name",
+                "new_number",
+            )
+        ),
+    )
 
 
-def get_sender_lookup_table(db: Database) -> Dict[uuid.UUID, Dict]:
+class SenderRegistry:
     """
-    get a dictionary of sender records with the names as lookup key.
+    Sender ids by name, loaded from the database once per import run.
 
-    this will not respect non-unique names.
+    Senders created by `get_id` are kept back until `insert_new_senders`
+    writes them, so every sender is inserted exactly once. With
+    `deterministic_ids`, new sender ids are derived from their names.
     """
-    lut = {}
-    for row in db["sender"].rows:
-        name = row["name"]
-        lut[name] = row
 
-    return lut
+    def __init__(self, db: Database, deterministic_ids: bool = False):
+        self.db = db
+        self.deterministic_ids = deterministic_ids
+        self._sender_ids = {
+            row["name"]: row["id"] for row in db.query("SELECT id, name FROM sender")
+        }
+        self._new_senders = []
+
+    def get_id(self, name: str) -> str:
+        sender_id = self._sender_ids.get(name)
+        if not sender_id:
+            sender_id = str(uuid.uuid4())
+            if self.deterministic_ids:
+                sender_id = str(content_id("sender", name))
+            self._sender_ids[name] = sender_id
+            self._new_senders.append({"id": sender_id, "name": name})
+
+        return sender_id
+
+    def insert_new_senders(self, writer: str = "sqlite-utils") -> None:
+        if self._new_senders:
+            if writer == "executemany":
+                with self.db.conn:
+                    _executemany(
+                        self.db,
+                        "sender",
+                        ("id", "name"),
+                        [(row["id"], row["name"]) for row in self._new_senders],
+                        ignore=True,
+                    )
+            else:
+                self.db["sender"].insert_all(self._new_senders, ignore=True)
+            self._new_senders = []
 
 
 def get_system_message_id(db: Database) -> uuid.UUID:
+    from sqlite_utils.db import NotFoundError
+
     try:
         system_message_id_dict = db["system_message_id"].get(1)
     except NotFoundError:
@@ -375,139 +1364,472 @@ def get_system_message_id(db: Database) -> uuid.UUID:
     return uuid.UUID(system_message_id_dict["system_message_id"])
 
 
-def crawl_directory(path: Path, glob: str = "**/*") -> List[Path]:
-    path_list = []
-    for glob_path in path.glob(glob):
-        if glob_path.is_dir():
+class FileEntry(NamedTuple):
+    """a file found by `scan_directory`, with the stat its cache key needs."""
+
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def from_path(cls, path: Path) -> "FileEntry":
+        stat = path.stat()
+        return cls(path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def scan_directory(
+    path: Path, pattern: str = "*", jobs: Optional[int] = None
+) -> Iterator[FileEntry]:
+    """
+    find files whose names match `pattern` in `path` and all subdirectories.
+
+    Directories are listed with `os.scandir` by a pool of `jobs` threads, at
+    most four per thread ahead of the caller, and their files are yielded
+    while the walk goes on. Regardless of thread scheduling, files are yielded
+    depth first and sorted by name, those of a directory before the ones in
+    its subdirectories. Like `Path.glob`, symlinks to directories are not
+    followed and directories that cannot be listed are skipped.
+    """
+    match = re.compile(fnmatch.translate(pattern)).match
+    pending = [path]
+    if jobs == 1:
+        while pending:
+            files, directories = _scan_one_directory(pending.pop(), match)
+            yield from files
+            pending.extend(reversed(directories))
+        return
+
+    jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # a stack of directories with the next one on top, the topmost ones
+        # are already being listed.
+        while pending:
+            for index in range(max(0, len(pending) - 4 * jobs), len(pending)):
+                if isinstance(pending[index], Path):
+                    pending[index] = executor.submit(
+                        _scan_one_directory, pending[index], match
+                    )
+
+            files, directories = pending.pop().result()
+            yield from files
+            pending.extend(reversed(directories))
+
+
+def _scan_one_directory(
+    path: Path, match: Callable
+) -> Tuple[List[FileEntry], List[Path]]:
+    files = []
+    directories = []
+    try:
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return files, directories
+
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    directories.append(Path(entry.path))
+            elif match(entry.name):
+                # free on windows, and on posix the media cache does not need
+                # to stat the file again
+                stat = entry.stat()
+                files.append(
+                    FileEntry(
+                        Path(entry.path), stat.st_size, stat.st_mtime_ns, stat.st_ino
+                    )
+                )
+        except FileNotFoundError:
+            # deleted since listing the directory, or a dangling symlink
             continue
 
-        path_list.append(glob_path)
+    return files, directories
+
 
-    return path_list
+def crawl_directory(
+    path: Path, pattern: str = "*", jobs: Optional[int] = None
+) -> List[Path]:
+    return [entry.path for entry in scan_directory(path, pattern, jobs)]
 
 
 def crawl_directory_for_chat_files(path: Path, locale: str) -> List[Path]:
     file_name_glob = get_chat_file_glob_by_locale(locale)
-    return crawl_directory(path, f"**/{file_name_glob}")
+    return crawl_directory(path, file_name_glob)
 
 
 def _get_hash(file_path: Path) -> bytes:
     hash_obj = hashlib.sha512()
     with file_path.open("rb") as file_obj:
-        for chunk in iter(lambda: file_obj.read(2048), b""):
+        for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
             hash_obj.update(chunk)
     return hash_obj.digest()
 
 
+def _batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """split an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _get_prefix_hashes(file_path: Path, offsets: List[int]) -> Dict[int, str]:
+    """get sha512 hex digests of the first `offset` bytes of a file."""
+    prefix_hashes = {}
+    hash_obj = hashlib.sha512()
+    position = 0
+    with file_path.open("rb") as file_obj:
+        for offset in sorted(set(offsets)):
+            while position < offset:
+                chunk = file_obj.read(min(HASH_CHUNK_SIZE, offset - position))
+                if not chunk:
+                    return prefix_hashes
+                hash_obj.update(chunk)
+                position += len(chunk)
+
+            prefix_hashes[offset] = hash_obj.hexdigest()
+
+    return prefix_hashes
+
+
 def match_media_files(
     db: Database,
     logger: Logger,
     set_progress_size=lambda *_, **__: None,
     progress_callback=lambda *_: None,
 ):
-    """match media files imported from file system to file names from chats."""
+    """
+    match media files imported from file system to file names from chats.
+
+    A chat file name matches if exactly one media file has that name. Matches
+    are resolved in a few set-based statements over an indexed temporary
+    table, instead of querying `file_fs` once per chat file.
+    """
     logger.debug("Attempting to match imported media to imported chats")
+    set_progress_size(4)
+
+    db.conn.create_function("file_url", 2, _get_file_url, deterministic=True)
+    with db.conn:
+        db.execute("DROP TABLE IF EXISTS temp.file_match")
+        db.execute(
+            "CREATE TEMP TABLE file_match AS "
+            "SELECT name, sha512sum, preview, mime_type, size, original_file_path "
+            "FROM file_fs WHERE name IN (SELECT name FROM file_chat) "
+            "GROUP BY name HAVING COUNT(*) = 1"
+        )
+        db.execute("CREATE UNIQUE INDEX temp.file_match_name ON file_match (name)")
+        for row in db.query(
+            "SELECT name FROM file_fs WHERE name IN (SELECT name FROM file_chat) "
+            "GROUP BY name HAVING COUNT(*) > 1"
+        ):
+            logger.debug(
+                "more than one match for file name '%s', skipping.", row["name"]
+            )
+        progress_callback()
 
-    # iterate over files that occur in chat messages
-    progress_size = db["file_chat"].count
-    set_progress_size(progress_size)
-
-    file_fs_imported = []
-    file_objects = []
-    file_copyable = []
-    for row in db["file_chat"].rows:
-        file_id = row["id"]
-        file_name = row["name"]
-        if db["file_fs"].count_where("name = ?", [file_name]) > 1:
-            logger.debug("more than one match for file name '%s', skipping.", file_name)
-            continue
+        db.execute(
+            "UPDATE file_chat SET sha512sum = ("
+            "SELECT sha512sum FROM file_match WHERE file_match.name = file_chat.name"
+            ") WHERE name IN (SELECT name FROM file_match)"
+        )
+        progress_callback()
 
-        for file_fs in db["file_fs"].rows_where("name = ?", [file_name]):
-            # this should only yield one row, see check above
-            file_fs_id = file_fs["id"]
-            file_fs_sum = file_fs["sha512sum"]
-            file_fs_preview = file_fs["preview"]
-            file_fs_path = file_fs["original_file_path"]
-            file_fs_mimetype = file_fs["mime_type"]
-            file_fs_size = file_fs["size"]
-            file_url = (
-                config_url_format.format(file_fs_sum) + f"?mimetype={file_fs_mimetype}"
-            )
-            db["file_chat"].update(
-                file_id,
-                {
-                    "sha512sum": file_fs_sum,
-                },
-            )
-            file_objects.append(
-                {
-                    "sha512sum": file_fs_sum,
-                    "url": file_url,
-                    "preview": file_fs_preview,
-                    "mime_type": file_fs_mimetype,
-                    "size": file_fs_size,
-                }
-            )
-            file_copyable.append(
-                {
-                    "original_file_path": str(file_fs_path),
-                    "target_file_path": file_fs_sum,
-                }
-            )
-            file_fs_imported.append(file_fs_id)
-            break
+        # in order of the chat files, the first file object of a digest wins
+        db.execute(
+            "INSERT OR IGNORE INTO file_object "
+            "(sha512sum, url, preview, mime_type, size) "
+            "SELECT file_match.sha512sum, "
+            "file_url(file_match.sha512sum, file_match.mime_type), "
+            "file_match.preview, file_match.mime_type, file_match.size "
+            "FROM file_chat JOIN file_match ON file_match.name = file_chat.name "
+            "ORDER BY file_chat.rowid"
+        )
+        progress_callback()
 
+        db.execute(
+            "INSERT INTO file_copyable (original_file_path, target_file_path) "
+            "SELECT file_match.original_file_path, file_match.sha512sum "
+            "FROM file_chat JOIN file_match ON file_match.name = file_chat.name "
+            "ORDER BY file_chat.rowid"
+        )
+        db.execute("DROP TABLE temp.file_match")
         progress_callback()
 
-    db["file_object"].insert_all(file_objects, ignore=True)
-    db["file_copyable"].insert_all(file_copyable)
-    # if file_fs_imported:
-    #    db["file_fs"].delete_where("id = ?", file_fs_imported)
+
+def _get_file_url(sha512sum: str, mime_type: Optional[str]) -> str:
+    return config_url_format.format(sha512sum) + f"?mimetype={mime_type}"
 
 
 def import_media_to_db(
-    files: List[Path],
+    files: Iterable[Union[Path, FileEntry]],
     db: Database,
     logger: Logger,
     progress_callback=lambda *_: None,
+    jobs: Optional[int] = None,
+    use_cache: bool = True,
+    referenced_only: bool = False,
+    previews: bool = True,
+    metrics: Optional[Metrics] = None,
 ):
-    """import media from file system into a db table `file_fs`."""
-    logger.debug("Attempting to import %s media files to database", len(files))
-
-    # inserting appears to be kinda slow, so we are chunking our inserts to 1000 files at a time
-    def chunker(iterable, n, fillvalue=None):
-        args = [iter(iterable)] * n
-        return itertools.zip_longest(*args, fillvalue=fillvalue)
-
-    for chunk in chunker(files, 1000):
-        files_in_chunk = []
-        for path in chunk:
-            # handle fillvalue
-            if path is None:
-                break
+    """
+    import media from file system into a db table `file_fs`.
+
+    `files` may be any iterable of paths or `FileEntry`s, e.g. from
+    `scan_directory`, and is consumed while files are being imported.
+    Files are hashed and previewed by a pool of `jobs` worker threads
+    (default: one per CPU, plus a few for I/O). Hashing and image decoding
+    release the GIL, so threads scale without pickling file contents. Rows are
+    inserted in batches in the order of `files` while the workers continue.
+
+    Digest, mime type and preview of every file are kept in `file_fs_cache`.
+    Files with the same size, mtime and inode as in the cache are not read
+    again, unless `use_cache` is unset.
+
+    With `referenced_only`, files whose names do not occur in `file_chat` are
+    skipped without being read, as `match_media_files` could not match them.
+    Without `previews`, previews are left to `generate_previews`.
+    Hashing, previewing and inserting is measured in `metrics`.
+    """
+    metrics = metrics or Metrics()
+    if referenced_only:
+        referenced_names = {
+            row["name"] for row in db.query("SELECT DISTINCT name FROM file_chat")
+        }
+
+        def referenced(files: Iterable) -> Iterator:
+            for file in files:
+                if _get_path(file).name in referenced_names:
+                    yield file
+                else:
+                    progress_callback()
+
+        logger.debug("Skipping media files not referenced by chats")
+        files = referenced(files)
+
+    logger.debug("Attempting to import media files to database")
+
+    def with_cached_entries():
+        for batch in _batched(files, INSERT_BATCH_SIZE):
+            cached_entries = {}
+            if use_cache:
+                paths = [_get_path(file) for file in batch]
+                cached_entries = _get_cached_media_entries(db, paths)
+            for file in batch:
+                yield file, cached_entries.get(str(_get_path(file)))
+
+    records = _map_in_threads(
+        lambda item: get_media_file_record(
+            *item, logger=logger, previews=previews, metrics=metrics
+        ),
+        with_cached_entries(),
+        jobs,
+    )
+    for batch in _batched(records, INSERT_BATCH_SIZE):
+        with metrics.measure("insert-files", items=len(batch)):
+            db["file_fs"].insert_all(row for row, _ in batch)
+            cache_entries = [entry for _, entry in batch if entry]
+            if cache_entries:
+                db["file_fs_cache"].upsert_all(cache_entries, pk="path")
+        for _ in batch:
+            progress_callback()
+
+
+def get_media_file_record(
+    file: Union[Path, FileEntry],
+    cached_entry: Optional[Dict],
+    logger: Logger,
+    previews: bool = True,
+    metrics: Optional[Metrics] = None,
+) -> Tuple[Dict, Optional[Dict]]:
+    """
+    stat, hash and preview a media file.
 
-            file_id = uuid.uuid4()
-            file_name = path.name
+    Files from `scan_directory` are not stat'ed again. Returns the `file_fs`
+    row of the file and, unless `cached_entry` could be used because the file
+    did not change, its new `file_fs_cache` row. Cached entries whose preview
+    was deferred get their preview now, if `previews` is set. Hashing and
+    previewing are measured in `metrics` for the file as well.
+    """
+    if not isinstance(file, FileEntry):
+        file = FileEntry.from_path(file)
+    metrics = metrics or Metrics()
+    # stages are attributed per thread, so workers can record their own file
+    metrics.set_file(file.path)
+    try:
+        return _get_media_file_record(file, cached_entry, logger, previews, metrics)
+    finally:
+        metrics.set_file(None)
+
+
+def _get_media_file_record(
+    file: FileEntry,
+    cached_entry: Optional[Dict],
+    logger: Logger,
+    previews: bool,
+    metrics: Metrics,
+) -> Tuple[Dict, Optional[Dict]]:
+    path = file.path
+    cache_key = {
+        "path": str(path),
+        "size": file.size,
+        "mtime_ns": file.mtime_ns,
+        "inode": file.inode,
+    }
+    cache_entry = None
+    if cached_entry is None or any(
+        cached_entry[key] != value for key, value in cache_key.items()
+    ):
+        file_mime_type, _ = mimetypes.guess_type(path.name)
+        with metrics.measure("hash", items=1, size=file.size):
             file_sha512sum = _get_hash(path)
-            file_mime_type, _ = mimetypes.guess_type(file_name)
+
+        cache_entry = cached_entry = {
+            **cache_key,
+            "sha512sum": file_sha512sum.hex(),
+            "mime_type": file_mime_type,
+            "preview": None,
+            "preview_attempted": False,
+        }
+
+    if (
+        previews
+        and cached_entry["preview"] is None
+        and not cached_entry.get("preview_attempted")
+    ):
+        with metrics.measure("preview", items=1):
             # FIXME(skowalak): file_preview requires PIL, make that optional
-            file_preview = _generate_preview(path, file_mime_type, logger)
-            file_size = path.stat().st_size
-
-            files_in_chunk.append(
-                {
-                    "id": str(file_id),
-                    "name": file_name,
-                    "sha512sum": file_sha512sum.hex(),
-                    "mime_type": file_mime_type,
-                    "preview": file_preview,
-                    "size": file_size,
-                    "original_file_path": str(path),
-                }
+            file_preview = _generate_preview(path, cached_entry["mime_type"], logger)
+        cache_entry = cached_entry = {
+            **cached_entry,
+            "preview": file_preview,
+            "preview_attempted": True,
+        }
+
+    row = {
+        "id": str(uuid.uuid4()),
+        "name": path.name,
+        "sha512sum": cached_entry["sha512sum"],
+        "mime_type": cached_entry["mime_type"],
+        "preview": cached_entry["preview"],
+        "preview_attempted": bool(cached_entry.get("preview_attempted")),
+        "size": file.size,
+        "original_file_path": str(path),
+    }
+    return row, cache_entry
+
+
+def _get_path(file: Union[Path, FileEntry]) -> Path:
+    return file.path if isinstance(file, FileEntry) else file
+
+
+def _get_cached_media_entries(db: Database, paths: List[Path]) -> Dict[str, Dict]:
+    """get `file_fs_cache` rows of `paths`, by path."""
+    entries = {}
+    for batch in _batched(paths, SQLITE_MAX_VARIABLES):
+        placeholders = ", ".join("?" for _ in batch)
+        for row in db.query(
+            f"SELECT * FROM file_fs_cache WHERE path IN ({placeholders})",
+            [str(path) for path in batch],
+        ):
+            entries[row["path"]] = row
+    return entries
+
+
+def _map_in_threads(
+    function: Callable, iterable: Iterable, jobs: Optional[int] = None
+) -> Iterator:
+    """
+    like `map`, but calls `function` in a pool of `jobs` threads.
+
+    Results are yielded in order. At most four items per thread are processed
+    ahead of the caller, so results do not pile up in memory.
+    """
+    if jobs == 1:
+        yield from map(function, iterable)
+        return
+
+    jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        items = iter(iterable)
+        pending = collections.deque(
+            executor.submit(function, item)
+            for item in itertools.islice(items, 4 * jobs)
+        )
+        while pending:
+            future = pending.popleft()
+            next_item = next(items, None)
+            if next_item is not None:
+                pending.append(executor.submit(function, next_item))
+
+            yield future.result()
+
+
+def generate_previews(
+    db: Database,
+    logger: Logger,
+    set_progress_size=lambda *_, **__: None,
+    progress_callback=lambda *_: None,
+    jobs: Optional[int] = None,
+) -> int:
+    """
+    generate previews of `file_fs` rows without one in `jobs` worker processes.
+
+    Missing previews of file objects and of the media cache are filled in as
+    well. Files which cannot have a preview are marked as attempted and not
+    decoded again. Returns the number of generated previews.
+    """
+    files = [
+        (row["original_file_path"], row["mime_type"])
+        for row in db.query(
+            "SELECT DISTINCT original_file_path, mime_type FROM file_fs "
+            "WHERE preview IS NULL AND NOT coalesce(preview_attempted, 0)"
+        )
+    ]
+    logger.debug("Attempting to generate %s previews", len(files))
+    set_progress_size(len(files))
+
+    generated_previews = 0
+    with contextlib.ExitStack() as stack:
+        if jobs == 1:
+            previews = map(_generate_preview_in_worker, files)
+        else:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
             )
-            progress_callback()
+            previews = executor.map(_generate_preview_in_worker, files, chunksize=16)
+
+        for batch in _batched(zip(files, previews), INSERT_BATCH_SIZE):
+            updates = [(preview, path) for (path, _), preview in batch]
+            with db.conn:
+                db.conn.executemany(
+                    "UPDATE file_fs SET preview = ?, preview_attempted = 1 "
+                    "WHERE original_file_path = ? AND preview IS NULL",
+                    updates,
+                )
+                db.conn.executemany(
+                    "UPDATE file_fs_cache SET preview = ?, preview_attempted = 1 "
+                    "WHERE path = ?",
+                    updates,
+                )
+            generated_previews += sum(1 for preview, _ in updates if preview)
+            for _ in batch:
+                progress_callback()
+
+    with db.conn:
+        db.execute(
+            "UPDATE file_object SET preview = ("
+            "SELECT preview FROM file_fs WHERE file_fs.sha512sum = "
+            "file_object.sha512sum AND file_fs.preview IS NOT NULL LIMIT 1"
+            ") WHERE preview IS NULL"
+        )
+
+    return generated_previews
 
-        db["file_fs"].insert_all(files_in_chunk)
+
+def _generate_preview_in_worker(file: Tuple[str, Optional[str]]) -> Optional[bytes]:
+    path, mime_type = file
+    return _generate_preview(Path(path), mime_type, logging.getLogger(__name__))
 
 
 def remove_media_duplicates(db) -> int:
@@ -531,7 +1853,27 @@ def move_files(
     logger: Logger,
     set_progress_size=lambda *_, **__: None,
     progress_callback=lambda *_: None,
+    strategy: str = "copy",
+    jobs: Optional[int] = None,
 ) -> List[Path]:
+    """
+    put copyable files into the content addressed `output_directory`.
+
+    Files are copied by a pool of `jobs` threads with one of
+    `COPY_STRATEGIES`: "copy" (a regular copy, which the kernel performs
+    without user space buffers), "reflink" (a copy-on-write clone on
+    filesystems supporting it, a regular copy otherwise), "hardlink" or
+    "symlink". Files that cannot be copied are logged and skipped. Returns
+    the copied source files which can be deleted now, i.e. none for symlinks.
+
+    Objects in `output_directory` are recorded in `file_store` and not copied
+    again, see `verify_media_store`. Stored objects which are symlinks (from
+    an earlier run with "symlink") are placed again with any other strategy,
+    so their sources are only listed once the object holds their data.
+    """
+    if strategy not in COPY_STRATEGIES:
+        raise ValueError(f"unknown copy strategy: {strategy}")
+
     # delete duplicate copyable files
     _ = db.execute(
         (
@@ -541,26 +1883,167 @@ def move_files(
             "where file_copyable.original_file_path = f2.original_file_path);"
         )
     )
-    copyable_files_count = db["file_copyable"].count
-    set_progress_size(copyable_files_count)
+    copyable_files = []
+    stored_files = []
+    for row in db.query(
+        "SELECT original_file_path, target_file_path, EXISTS ("
+        "SELECT 1 FROM file_store WHERE directory = ? AND sha512sum = "
+        "file_copyable.target_file_path) AS stored FROM file_copyable",
+        [str(output_directory)],
+    ):
+        target_file_name = row["target_file_path"]
+        copyable_file = (Path(row["original_file_path"]), target_file_name)
+        target = output_directory / target_file_name[:2] / target_file_name
+        if row["stored"] and (strategy == "symlink" or not target.is_symlink()):
+            stored_files.append(copyable_file)
+        else:
+            copyable_files.append(copyable_file)
 
+    set_progress_size(len(copyable_files) + len(stored_files))
     deleteable_files = []
-    print(f"Copying {copyable_files_count:n} files to {str(output_directory)}.")
-    for row in db["file_copyable"].rows:
-        source = Path(row["original_file_path"])
-        target_file_name = row["target_file_path"]
+    for source, _ in stored_files:
+        if strategy != "symlink":
+            deleteable_files.append(source)
+        progress_callback()
+
+    print(
+        f"Copying {len(copyable_files):n} files to {str(output_directory)}, "
+        f"{len(stored_files):n} are stored already."
+    )
+    # sources with the same content share their target, which is placed once,
+    # so no two threads write the same object.
+    sources_by_target = collections.defaultdict(list)
+    for source, target_file_name in copyable_files:
+        sources_by_target[target_file_name].append(source)
+    for fan_out_directory in {target[:2] for target in sources_by_target}:
+        (output_directory / fan_out_directory).mkdir(parents=True, exist_ok=True)
+
+    def copy(target_file_name: str) -> Optional[Exception]:
         target = output_directory / target_file_name[:2] / target_file_name
-        target.parent.mkdir(parents=True, exist_ok=True)
+        error = None
+        for source in sources_by_target[target_file_name]:
+            try:
+                _copy_file(source, target, strategy)
+                return None
+            except OSError as exception:
+                error = exception
+        return error
+
+    failed_files = 0
+    targets = list(sources_by_target)
+    results = zip(targets, _map_in_threads(copy, targets, jobs))
+    for batch in _batched(results, INSERT_BATCH_SIZE):
+        stored_objects = []
+        for target_file_name, error in batch:
+            sources = sources_by_target[target_file_name]
+            for source in sources:
+                progress_callback()
+                if error:
+                    logger.error("error copying file %s: %s", source, error)
+            if error:
+                failed_files += len(sources)
+                continue
+
+            stored_objects.append(
+                {"directory": str(output_directory), "sha512sum": target_file_name}
+            )
+            if strategy != "symlink":
+                deleteable_files.extend(sources)
+
+        db["file_store"].insert_all(stored_objects, ignore=True)
+
+    if failed_files:
+        logger.warning("%s files could not be copied.", failed_files)
+
+    return deleteable_files
+
+
+def _copy_file(source: Path, target: Path, strategy: str) -> None:
+    if os.path.lexists(target):
+        # a symlink to the source is only good enough for "symlink"
+        if (
+            (strategy == "symlink" or not target.is_symlink())
+            and target.exists()
+            and os.path.samefile(source, target)
+        ):
+            return
+        # never write through a link to another file, e.g. the source
+        target.unlink()
+
+    if strategy == "hardlink":
+        os.link(source, target)
+    elif strategy == "symlink":
+        source.stat()  # do not create dangling links
+        os.symlink(source, target)
+    elif strategy == "reflink" and _reflink(source, target):
+        shutil.copymode(source, target)
+    else:
+        shutil.copy(source, target)
+
+
+def _reflink(source: Path, target: Path) -> bool:
+    """clone a file sharing its data blocks, returns whether it worked."""
+    try:
+        import fcntl  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return False
+
+    with source.open("rb") as source_obj, target.open("wb") as target_obj:
         try:
-            shutil.copy(source, target)
-        except Exception as exception:
-            logger.critical("error copying file: %s", exception, exc_info=True)
-            break
+            fcntl.ioctl(target_obj.fileno(), FICLONE, source_obj.fileno())
+        except OSError:
+            return False
+    return True
+
+
+def verify_media_store(
+    db: Database,
+    output_directory: Path,
+    logger: Logger,
+    set_progress_size=lambda *_, **__: None,
+    progress_callback=lambda *_: None,
+    sample: Optional[int] = None,
+    jobs: Optional[int] = None,
+) -> List[str]:
+    """
+    hash the objects `file_store` lists for `output_directory` again.
 
-        deleteable_files.append(source)
+    Checks a random `sample` of objects, or all of them, in a pool of `jobs`
+    threads. Missing or corrupt objects, and symlinks, which only point to
+    data elsewhere, are removed from `file_store`, so the next `move_files`
+    copies them again. Returns their digests.
+    """
+    query = "SELECT sha512sum FROM file_store WHERE directory = ?"
+    query_args = [str(output_directory)]
+    if sample is not None:
+        query += " ORDER BY RANDOM() LIMIT ?"
+        query_args.append(sample)
+    digests = [row["sha512sum"] for row in db.query(query, query_args)]
+    set_progress_size(len(digests))
+
+    def is_valid(sha512sum: str) -> bool:
+        object_path = output_directory / sha512sum[:2] / sha512sum
+        if object_path.is_symlink():
+            return False
+        try:
+            return _get_hash(object_path).hex() == sha512sum
+        except OSError:
+            return False
+
+    invalid_digests = []
+    for sha512sum, valid in zip(digests, _map_in_threads(is_valid, digests, jobs)):
+        if not valid:
+            logger.error("missing, corrupt or linked object: %s", sha512sum)
+            invalid_digests.append(sha512sum)
         progress_callback()
 
-    return deleteable_files
+    with db.conn:
+        db.conn.executemany(
+            "DELETE FROM file_store WHERE directory = ? AND sha512sum = ?",
+            [(str(output_directory), sha512sum) for sha512sum in invalid_digests],
+        )
+
+    return invalid_digests
 
 
 def write_list_of_files(files: List[Path], outfile: Path):
@@ -589,8 +2072,11 @@ def _generate_preview(file: Path, mime_type: str, logger: Logger) -> Optional[by
 
 
 def _generate_image_preview(img: Path, preview_size=(20, 20)) -> Optional[bytes]:
+    from PIL import Image
+
     with Image.open(img) as image:
-        image = Image.open(img)
+        # let JPEG images decode at a fraction of their size
+        image.draft("RGB", preview_size)
         image.thumbnail(preview_size)
 
         with io.BytesIO() as buffer: